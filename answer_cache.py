@@ -0,0 +1,159 @@
+import os
+import time
+import threading
+
+import numpy as np
+
+from metrics import record_cache
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+# Touched whenever vectors are upserted or deleted, so other processes see the change
+INDEX_VERSION_PATH = os.getenv("INDEX_VERSION_PATH", "cache/index_version")
+INDEX_STATS_INTERVAL = 60  # seconds between two vector count checks of a remote index
+
+
+class SemanticAnswerCache:
+    """Answers keyed by question embedding, matched by cosine similarity."""
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.vectors = None
+        self.entries = []  # dicts with question, answer, scope, created, last_used
+        self.index_version = None
+
+    def invalidate(self):
+        """Forget every answer, e.g. after the index contents changed."""
+        with self._lock:
+            self._clear()
+            self.stats["invalidations"] += 1
+
+    def _check_version(self, index_version):
+        if index_version != self.index_version:
+            if self.entries:
+                self.stats["invalidations"] += 1
+            self._clear()
+            self.index_version = index_version
+
+    def _drop(self, rows):
+        """Remove the given row positions from the matrix and entry list."""
+        keep = np.ones(len(self.entries), dtype=bool)
+        keep[list(rows)] = False
+        self.vectors = self.vectors[keep]
+        self.entries = [entry for entry, kept in zip(self.entries, keep) if kept]
+
+    def lookup(self, vector, index_version=None, scope=None):
+        """Return the cached answer of the closest question above the threshold, or None.
+
+        Only answers cached with the same scope (e.g. the namespaces searched) can match.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        now = time.time()
+        with self._lock:
+            self._check_version(index_version)
+            expired = [row for row, entry in enumerate(self.entries) if now - entry["created"] > self.ttl]
+            if expired:
+                self._drop(expired)
+            if not self.entries:
+                self.stats["misses"] += 1
+                record_cache("answer", False)
+                return None
+
+            in_scope = np.array([entry["scope"] == scope for entry in self.entries])
+            scores = np.where(in_scope, self.vectors @ query, -np.inf)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.stats["misses"] += 1
+                record_cache("answer", False)
+                return None
+            entry = self.entries[best]
+            entry["last_used"] = now
+            self.stats["hits"] += 1
+            record_cache("answer", True)
+            return entry["answer"]
+
+    def put(self, vector, question, answer, index_version=None, scope=None):
+        """Cache an answer, evicting the least recently used one when full."""
+        row = np.asarray(vector, dtype=np.float32)
+        row = row / (np.linalg.norm(row) or 1.0)
+        now = time.time()
+        with self._lock:
+            self._check_version(index_version)
+            if len(self.entries) >= self.max_entries:
+                oldest = min(range(len(self.entries)), key=lambda i: self.entries[i]["last_used"])
+                self._drop([oldest])
+                self.stats["evictions"] += 1
+            self.vectors = row[None, :] if self.vectors is None else np.vstack([self.vectors, row])
+            self.entries.append({"question": question, "answer": answer, "scope": scope, "created": now, "last_used": now})
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Return the process-wide answer cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticAnswerCache()
+        return _cache
+
+
+def mark_index_changed(path=INDEX_VERSION_PATH):
+    """Drop this process's answers and stamp the version file for the others (e.g. the app
+    while ingest.py runs)."""
+    get_answer_cache().invalidate()
+    if not path:
+        return
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(str(time.time_ns()))
+    os.replace(path + ".tmp", path)
+
+
+_vector_counts = {}  # id(index) -> (checked at, total vector count)
+_vector_counts_lock = threading.Lock()
+
+
+def _vector_count(index):
+    """Total vector count of a remote index, checked at most every INDEX_STATS_INTERVAL."""
+    now = time.monotonic()
+    with _vector_counts_lock:
+        checked_at, count = _vector_counts.get(id(index), (None, None))
+        if checked_at is not None and now - checked_at < INDEX_STATS_INTERVAL:
+            return count
+        # Mark as checked first so concurrent reruns don't all ask at once
+        _vector_counts[id(index)] = (now, count)
+    try:
+        count = index.describe_index_stats()["total_vector_count"]
+    except Exception:
+        return count
+    with _vector_counts_lock:
+        _vector_counts[id(index)] = (now, count)
+    return count
+
+
+def index_version(index, path=INDEX_VERSION_PATH):
+    """Token that changes when the index contents may have changed, in this process or another.
+
+    Combines LocalIndex's own version, the stamp of mark_index_changed (written by ingestion
+    on this host) and, for Pinecone, the vector count (changes made from elsewhere).
+    """
+    local_version = getattr(index, "version", None)
+    try:
+        stamp = os.stat(path).st_mtime_ns if path else None
+    except OSError:
+        stamp = None
+    return local_version, stamp, _vector_count(index) if local_version is None else None
@@ -1,16 +1,43 @@
 import streamlit as st
 import os
-import pandas as pd
+import time
+import uuid
 
 
 import json   #importation pour tab5
-import plotly.express as px
-import plotly.graph_objects as go
-import base64
-from dotenv import load_dotenv, find_dotenv
-import openai
-from github import Github
-from pinecone import Pinecone
+import html
+
+from lazy_imports import lazy_import, startup_report, PROCESS_STARTED
+from answer_cache import get_answer_cache, index_version
+from metrics import get_metrics, start_exporter, trace
+from storage import get_storage
+from images import save_upload, thumbnail_bytes
+from surveys import SATISFACTION_LEVELS, get_survey_store
+from rag import initialize_pinecone
+from async_pipeline import PendingQuestion, refine_answer, stream_answer
+from context import MODEL_LIMITS, DEFAULT_LIMITS, assemble_context
+from memory import ConversationMemory
+from namespaces import THEMES, ALL_THEMES, MUNICIPALITY
+from scheduler import llm_slot, estimate_tokens, set_session
+from idea_index import DUPLICATE_THRESHOLD, get_idea_index
+from moderation import TOXICITY_THRESHOLD, start_moderation
+
+rerun_started = time.perf_counter()
+
+# Heavy modules are only imported by the page that first needs them
+pd = lazy_import("pandas")
+
+# Process-wide store shared by every session
+storage = get_storage()
+# Scores new comments in the background, in batches (see moderation.py)
+moderation = start_moderation(storage)
+FEED_PAGE_SIZE = 10
+CHAT_GREETING = "Posez vos questions relatives à la participation citoyenne et aux sciences politiques !"
+CHAT_VISIBLE_MESSAGES = 20  # kept in the session; older messages are read back from storage on demand
+CHAT_PAGE_SIZE = 20
+
+# Writes METRICS_PATH periodically (and serves METRICS_PORT if set), once per process
+start_exporter()
 
 # Set up Streamlit page
 st.set_page_config(
@@ -112,37 +139,15 @@ st.markdown(
 )
 
 # Initialize session state
+# (announcements, comments and proposals are shared by every session, see storage.py)
 if "current_page" not in st.session_state:
     st.session_state["current_page"] = "home"
-if "comments" not in st.session_state:
-    st.session_state["comments"] = [[] for _ in range(3)]
-if "new_comments" not in st.session_state:
-    st.session_state["new_comments"] = ["" for _ in range(3)]
-if "proposals" not in st.session_state:
-    st.session_state["proposals"] = []
-if "announcements" not in st.session_state:
-    st.session_state["announcements"] = [
-        {
-            "title": "Projet environnemental Rue de la Paix",
-            "date": "10 février",
-            "desc": "Une initiative pour réduire les déchets et promouvoir la biodiversité urbaine.",
-            "image": "images/environment.jpg",
-        },
-        {
-            "title": "Aménagement cyclable Avenue des Fleurs",
-            "date": "15 février",
-            "desc": "Proposition de nouvelles pistes cyclables pour une mobilité durable.",
-            "image": "images/cycling.jpg",
-        },
-        {
-            "title": "Réhabilitation de l'École Jean Moulin",
-            "date": "20 février",
-            "desc": "Travaux pour moderniser l'école et améliorer son efficacité énergétique.",
-            "image": "images/school.jpg",
-        },
-    ]
 if "is_admin" not in st.session_state:
     st.session_state["is_admin"] = False
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+# OpenAI calls of this rerun queue for this session (see scheduler.py)
+set_session(st.session_state["session_id"])
 
 # Admin Authentication with a Secret Code
 def authenticate_admin(secret_code):
@@ -161,41 +166,103 @@ if not st.session_state["is_admin"]:
 
 # Function to add a new announcement
 def add_announcement(title, description, image_path):
-    new_announcement = {
-        "title": title,
-        "date": "Ajoutée aujourd'hui",
-        "desc": description,
-        "image": image_path,
-    }
-    st.session_state["announcements"].append(new_announcement)
-    st.session_state["comments"].append([])
-    st.session_state["new_comments"].append("")
+    storage.add_announcement(title, description, image_path)
+
+# Published ideas close to a draft, best first: (announcement, cosine similarity) pairs
+def similar_ideas(title, description):
+    announcements = {a["id"]: a for a in storage.list_announcements()}
+    index = get_idea_index()
+    try:
+        # Only announcements published since the last call are embedded
+        index.sync(announcements.values())
+        matches = index.similar(index.embed(title, description))
+    except Exception:
+        # The check is advisory: never block a submission because the embedding API failed
+        return []
+    return [(announcements[i], score) for i, score in matches if i in announcements]
+
+# Groups of near-identical published ideas, for triage
+def duplicate_ideas():
+    announcements = {a["id"]: a for a in storage.list_announcements()}
+    index = get_idea_index()
+    try:
+        index.sync(announcements.values())
+    except Exception:
+        pass  # cluster what is already indexed
+    return [[announcements[i] for i in group if i in announcements] for group in index.clusters()]
 
 # Function to add an announcement to proposals
-def add_to_proposals(index):
-    announcement = st.session_state["announcements"][index]
-    comments = st.session_state["comments"][index]
-    st.session_state["proposals"].append({
-        "announcement": announcement,
-        "comments": comments.copy()
-    })
+def add_to_proposals(announcement_id):
+    storage.add_to_proposals(announcement_id)
+
+# Callback of the comment send button: runs before the rerun, so the input can be cleared
+def send_comment(announcement_id):
+    key = f"comment_input_{announcement_id}"
+    comment = st.session_state.get(key, "").strip()
+    if comment:
+        storage.add_comment(announcement_id, comment)
+        moderation.nudge()
+        st.session_state[key] = ""
+
+# Callback of the chat input: runs before the rerun, so the embedding and keyword search
+# are already in flight while the chat history renders
+def prefetch_question():
+    question = st.session_state.get("chat_question")
+    if question:
+        # Callbacks run before the script body sets the session
+        set_session(st.session_state["session_id"])
+        st.session_state["pending_question"] = PendingQuestion(question, theme=st.session_state.get("rag_chat_theme"))
+
+# Start a new chat: fresh archive id and an empty conversation memory
+def new_conversation():
+    st.session_state["conversation_id"] = uuid.uuid4().hex
+    st.session_state["messages"] = []
+    st.session_state["message_seq"] = 0
+    st.session_state["older_messages_shown"] = 0
+    st.session_state["memory"] = ConversationMemory()
+    record_chat_message("assistant", CHAT_GREETING, remember=False)
+
+# Archive a chat message and keep only the latest ones in the session
+def record_chat_message(role, content, remember=True):
+    seq = st.session_state["message_seq"]
+    st.session_state["message_seq"] = seq + 1
+    storage.add_chat_message(st.session_state["conversation_id"], seq, role, content)
+    st.session_state["messages"].append({"role": role, "content": content, "seq": seq})
+    del st.session_state["messages"][:-CHAT_VISIBLE_MESSAGES]
+    if remember:
+        st.session_state["memory"].add(role, content)
+
+# Cached existence and metadata check, so the feed does not stat every image on every rerun
+@st.cache_data(ttl=300, max_entries=1024, show_spinner=False)
+def image_info(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
 
 # Gestion des pages
 if st.session_state["current_page"] == "dashboard":
     st.button("⬅️ Retour aux analyses", on_click=lambda: st.session_state.update({"current_page": "home"}))
-    st.markdown("<div class='header'>📈 Analyse du thème</div>", unsafe_allow_html=True)
+    dashboard_theme = st.session_state.get("dashboard_theme")
+    st.markdown(f"<div class='header'>📈 Analyse du thème : {dashboard_theme}</div>", unsafe_allow_html=True)
     st.write("Voici les analyses détaillées pour le thème sélectionné.")
 
-    # Exemple de tableau de bord
+    # Aggregates are memoized by the survey store until new responses are written
+    survey_stats = get_survey_store().aggregates(dashboard_theme)
+    st.metric("Réponses", survey_stats["responses"])
+
     st.subheader("Statistiques clés")
-    st.bar_chart({"Mois": ["Janvier", "Février", "Mars"], "Réponses": [100, 150, 120]})
+    st.bar_chart(survey_stats["monthly"].rename("Réponses").rename_axis("Mois"))
     st.subheader("Détails des réponses")
     st.dataframe(
         pd.DataFrame({
-            "Catégorie": ["Très satisfait", "Satisfait", "Neutre", "Insatisfait", "Très insatisfait"],
-            "Nombre": [40, 60, 30, 20, 10],
-        })
+            "Catégorie": survey_stats["satisfaction"].index.astype(str),
+            "Nombre": survey_stats["satisfaction"].to_numpy(),
+        }),
+        hide_index=True,
     )
+    st.subheader("Sous-thèmes")
+    st.bar_chart(survey_stats["by_sub_theme"].rename("Réponses").rename_axis("Sous-thème"))
 else:
     # Layout management
     if st.session_state["is_admin"]:
@@ -212,27 +279,52 @@ else:
             new_title = st.text_input("Titre de l'idée", key="new_title")
             new_desc = st.text_area("Description de l'idée", key="new_desc")
             new_image = st.file_uploader("Uploader une image", type=["png", "jpg", "jpeg"], key="new_image")
+
+            # Existing ideas close to this one, shown before it is submitted
+            near_duplicates = []
+            if new_title and new_desc:
+                similar = similar_ideas(new_title, new_desc)
+                if similar:
+                    st.markdown("**Idées similaires déjà proposées :**")
+                    for announcement, score in similar:
+                        st.caption(f"{announcement['title']} ({announcement['date']}) — similarité {score:.0%}")
+                near_duplicates = [announcement for announcement, score in similar if score >= DUPLICATE_THRESHOLD]
+            confirmed = True
+            if near_duplicates:
+                confirmed = st.checkbox("Mon idée est différente de celles-ci", key="new_idea_confirmed")
+
             if st.button("Soumettre", key="submit_new_idea"):
-                if new_title and new_desc:
-                    image_folder = "images"
-                    if not os.path.exists(image_folder):
-                        os.makedirs(image_folder)
+                if new_title and new_desc and not confirmed:
+                    st.warning(f"Une idée très proche existe déjà : « {near_duplicates[0]['title']} ». Commentez-la ou confirmez que la vôtre est différente.")
+                elif new_title and new_desc:
                     image_path = "images/default.jpg"
                     if new_image:
-                        image_path = os.path.join(image_folder, new_image.name)
-                        with open(image_path, "wb") as f:
-                            f.write(new_image.read())
-                    add_announcement(new_title, new_desc, image_path)
-                    st.success("Votre idée a été ajoutée avec succès !")
+                        # Content-hash file name + thumbnail built once, at upload time
+                        try:
+                            image_path = save_upload(new_image.getvalue(), new_image.name)
+                        except ValueError:
+                            image_path = None
+                            st.error("Le fichier joint n'est pas une image valide. Choisissez un fichier PNG ou JPEG.")
+                    if image_path:
+                        add_announcement(new_title, new_desc, image_path)
+                        st.success("Votre idée a été ajoutée avec succès !")
                 else:
                     st.error("Veuillez remplir tous les champs.")
 
-        # Display announcements
-        for i, announcement in enumerate(st.session_state["announcements"]):
-            if os.path.exists(announcement["image"]):
+        # Display announcements, one page at a time (cursor = id of the last announcement shown)
+        if "feed_cursors" not in st.session_state:
+            st.session_state["feed_cursors"] = [0]
+        page, next_cursor = storage.list_announcements_page(st.session_state["feed_cursors"][-1], FEED_PAGE_SIZE)
+        comment_counts = storage.comment_counts(announcement["id"] for announcement in page)
+
+        for announcement in page:
+            i = announcement["id"]
+            info = image_info(announcement["image"])
+            if info is not None:
                 col1, col2, col3 = st.columns([1, 4, 1])
                 with col1:
-                    st.image(announcement["image"], use_container_width=True)
+                    # Only the downscaled thumbnail is sent to the browser
+                    st.image(thumbnail_bytes(announcement["image"], mtime=info["mtime"]), use_container_width=True)
                 with col2:
                     st.markdown(
                         f"""
@@ -250,47 +342,57 @@ else:
                             add_to_proposals(i)
                             st.success("Annonce ajoutée aux propositions !")
 
-                # Comments section
-                st.markdown("**Commentaires**")
-                with st.container():
-                    st.markdown(
-                        f"<div class='comment-section'>" +
-                        "".join([f"<div class='comment'>{comment}</div>" for comment in st.session_state['comments'][i]]) +
-                        "</div>",
-                        unsafe_allow_html=True,
-                    )
-
-                # Input and send button for comments
-                comment_col1, comment_col2 = st.columns([8, 1])
-                with comment_col1:
-                    st.session_state["new_comments"][i] = st.text_input(
-                        "Ajouter un commentaire", 
-                        value=st.session_state["new_comments"][i], 
-                        key=f"comment_input_{i}", 
-                        label_visibility="collapsed"
-                    )
-                with comment_col2:
-                    if st.button("➤", key=f"send_comment_{i}"):
-                        if st.session_state["new_comments"][i].strip():
-                            st.session_state["comments"][i].append(st.session_state["new_comments"][i].strip())
-                            st.session_state["new_comments"][i] = ""
+                # Comments section: the thread is only loaded and rendered once opened
+                if st.toggle(f"Commentaires ({comment_counts[i]})", key=f"show_comments_{i}"):
+                    with st.container():
+                        st.markdown(
+                            f"<div class='comment-section'>" +
+                            # Comments scored as toxic are hidden; the others are escaped, never rendered as HTML
+                            "".join([f"<div class='comment'>{html.escape(comment)}</div>" for comment in storage.list_comments(i, TOXICITY_THRESHOLD)]) +
+                            "</div>",
+                            unsafe_allow_html=True,
+                        )
+
+                    # Input and send button for comments
+                    comment_col1, comment_col2 = st.columns([8, 1])
+                    with comment_col1:
+                        st.text_input(
+                            "Ajouter un commentaire", 
+                            key=f"comment_input_{i}", 
+                            label_visibility="collapsed"
+                        )
+                    with comment_col2:
+                        st.button("➤", key=f"send_comment_{i}", on_click=send_comment, args=(i,))
 
             else:
                 st.error(f"Image non trouvée : {announcement['image']}")
 
+        # Pagination
+        prev_col, _, next_col = st.columns([1, 4, 1])
+        with prev_col:
+            if len(st.session_state["feed_cursors"]) > 1:
+                st.button("⬅️ Précédentes", key="feed_previous",
+                          on_click=lambda: st.session_state["feed_cursors"].pop())
+        with next_col:
+            if next_cursor is not None:
+                st.button("Suivantes ➡️", key="feed_next",
+                          on_click=lambda: st.session_state["feed_cursors"].append(next_cursor))
+
     # Onglet 2 : Sondages
         with tab2:
             st.markdown("<div class='header'>📊 Sondages</div>", unsafe_allow_html=True)
             themes = ["Pollution environnementale", "Social", "Économie", "Transport", "Culture"]
             theme_selection = st.selectbox("Choisissez un thème :", themes)
-            st.multiselect("Quels sont les sous-thèmes qui vous concernent le plus ?", [
+            sub_theme_selection = st.multiselect("Quels sont les sous-thèmes qui vous concernent le plus ?", [
                 "Qualité de l'air",
                 "Gestion des déchets",
                 "Chauffage urbain",
                 "Énergies renouvelables",
             ])
-            st.text_area("Commentaires libres :", placeholder="Partagez vos idées...")
+            satisfaction_selection = st.select_slider("Êtes-vous satisfait de la situation actuelle ?", SATISFACTION_LEVELS[::-1], value="Neutre")
+            free_comment = st.text_area("Commentaires libres :", placeholder="Partagez vos idées...")
             if st.button("Soumettre"):
+                get_survey_store().submit(theme_selection, sub_theme_selection, satisfaction_selection, free_comment)
                 st.success("Merci pour votre contribution !")
         
         # Onglet 3 : Analyses
@@ -299,10 +401,28 @@ else:
                 st.markdown("<div class='header'>📈 Analyses</div>", unsafe_allow_html=True)
 
                 analysis_themes = ["Pollution environnementale", "Social", "Économie", "Transport", "Culture"]
+                responses_by_theme = get_survey_store().aggregates()["by_theme"]
                 st.markdown("### Cliquez sur un thème pour voir les analyses :")
                 for theme in analysis_themes:
-                    if st.button(f"📊 {theme}", key=theme):
-                        st.session_state["current_page"] = "dashboard"
+                    st.button(f"📊 {theme} ({responses_by_theme.get(theme, 0)} réponses)", key=theme,
+                              on_click=lambda theme=theme: st.session_state.update({"current_page": "dashboard", "dashboard_theme": theme}))
+
+                # Comment tone per announcement, from the background moderation scores
+                st.markdown("### Commentaires des annonces :")
+                comment_scores = storage.comment_score_aggregates(TOXICITY_THRESHOLD)
+                if comment_scores:
+                    titles = {a["id"]: a["title"] for a in storage.list_announcements()}
+                    st.dataframe([
+                        {
+                            "Annonce": titles.get(announcement_id, announcement_id),
+                            "Commentaires analysés": scores["scored"],
+                            "Sentiment moyen (-1 à 1)": round(scores["sentiment"], 2) if scores["sentiment"] is not None else None,
+                            "Commentaires masqués": scores["toxic"] or 0,
+                        }
+                        for announcement_id, scores in comment_scores.items()
+                    ], hide_index=True)
+                else:
+                    st.info("Aucun commentaire analysé pour le moment.")
 
         # Onglet 4 : Chat
         with tab4:
@@ -323,6 +443,33 @@ else:
 
     # Tab 5: Propositions
     with tab5:
+        # Announcements proposed by the admins, with the comments they had when proposed
+        st.markdown("<div class='header'>📌 Propositions</div>", unsafe_allow_html=True)
+        proposals = storage.list_proposals(TOXICITY_THRESHOLD)
+        if not proposals:
+            st.info("Aucune proposition pour le moment.")
+        for proposal in proposals:
+            announcement = proposal["announcement"]
+            with st.expander(f"{announcement['title']} ({announcement['date']}) — {len(proposal['comments'])} commentaire(s)"):
+                st.write(announcement["desc"])
+                st.markdown(
+                    "<div class='comment-section'>" +
+                    "".join(f"<div class='comment'>{html.escape(comment)}</div>" for comment in proposal["comments"]) +
+                    "</div>",
+                    unsafe_allow_html=True,
+                )
+
+        # Near-identical ideas grouped together, so admins can merge them
+        if st.session_state["is_admin"]:
+            with st.expander("🔁 Idées en double"):
+                clusters = duplicate_ideas()
+                if not clusters:
+                    st.info("Aucune idée en double détectée.")
+                for number, group in enumerate(clusters, 1):
+                    st.markdown(f"**Groupe {number}** ({len(group)} idées)")
+                    for announcement in group:
+                        st.caption(f"{announcement['title']} ({announcement['date']}) — {announcement['desc']}")
+
         st.markdown("<div class='header'>💬 Chat </div>", unsafe_allow_html=True)
         st.markdown(
             "<div class='header' style='font-size: small; font-style: italic;'>"
@@ -330,165 +477,8 @@ else:
             "</div>",
             unsafe_allow_html=True
         )
-
-        def load_environment_variables(env_paths):
-            """Load environment variables from specified paths."""
-            for folder, filename in env_paths:
-                dotenv_path = find_dotenv(os.path.join(folder, filename), raise_error_if_not_found=True, usecwd=True)
-                load_dotenv(dotenv_path, override=True)
-
-        def generate_openai_response(system_prompt, user_prompt, model_params, env_variables):
-            """Generate a response from the OpenAI model."""
-            openai.api_key = env_variables["openai_api_key"]
-
-            try:
-                response = openai.chat.completions.create(
-                    model=model_params['selected_model'],
-                    max_tokens=model_params['max_length'],
-                    temperature=model_params['temperature'],
-                    top_p=model_params['top_p'],
-                    frequency_penalty=model_params['frequency_penalty'],
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ]
-                )
-                return response.choices[0].message.content if response.choices else "No response found."
-            except Exception as e:
-                return f"An error occurred: {str(e)}"
-
-        def get_embedding(text, model="text-embedding-3-small"):
-            """Get text embedding."""
-            response =  openai.embeddings.create(
-                model=model,
-                input=text,
-                encoding_format="float"
-            )
-            return response.data[0].embedding
-
-        def summarize_text(text, model="gpt-4o", max_length=512):
-            """Summarize the given text."""
-            try:
-                response = openai.chat.completions.create(
-                    model=model,
-                    messages=[{"role": "user", "content": f"Summarize the following text:\n\n{text}"}],
-                    max_tokens=max_length,
-                    temperature=0.7
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                return f"Summary error: {str(e)}"
-
-        def refine_response(text, prompt, model="gpt-4o", max_length=1024):
-            """Refine the response based on the prompt."""
-            try:
-                response = openai.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": "Tu adoptes le ton d'un assistant amical. Ton rôle est de parler de la participation citoyenne à l'aide des conaissances fournies"},
-                        {"role": "user", "content": f"Affine et fait un sommaire des informations pertinentes afin de répondre à cette question : {prompt}\n\n{text}"}
-                    ],
-                    max_tokens=max_length,
-                    temperature=1
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                return f"Refinement error: {str(e)}"
-
-        # def extract_text_from_pdf(file_content):
-        #     """Extract text from a PDF file."""
-        #     images = convert_from_bytes(file_content, poppler_path=r'./myenv/poppler-24.08.0/Library/bin')
-        #     pytesseract.pytesseract.tesseract_cmd = r"./myenv/Tesseract-OCR/tesseract.exe"
-        #     text = "".join(pytesseract.image_to_string(image) for image in images)
-        #     return text
-
-        def chunk_text(text, max_tokens=8191):
-            """Chunk text into manageable pieces."""
-            words = text.split()
-            chunks, current_chunk, current_length = [], [], 0
-
-            for word in words:
-                word_length = len(word) + 1  # Account for space
-                if current_length + word_length <= max_tokens:
-                    current_chunk.append(word)
-                    current_length += word_length
-                else:
-                    chunks.append(" ".join(current_chunk))
-                    current_chunk, current_length = [word], word_length
-
-            if current_chunk:
-                chunks.append(" ".join(current_chunk))
-
-            return chunks
-
-        # def process_and_store_documents(repo_docs, pinecone_instance):
-        #     """Process documents and store them in Pinecone."""
-        #     vectors = []
-        #     progress_bar = st.progress(0)
-
-        #     for doc_id, document in enumerate(repo_docs):
-        #         extracted_text = extract_text_from_pdf(document['file_content'])
-        #         text_chunks = chunk_text(extracted_text, max_tokens=8191)
-
-        #         for i, chunk in enumerate(text_chunks):
-        #             summary = summarize_text(chunk)
-        #             vector = get_embedding(chunk)
-        #             vectors.append({
-        #                 "id": f"{doc_id}_{i}",
-        #                 "values": vector,
-        #                 "metadata": {
-        #                     "file_path": document['file_path'],
-        #                     "summary": summary
-        #                 }
-        #             })
-
-        #         progress_bar.progress((doc_id + 1) / len(repo_docs))
-
-        #     store_vectors_in_pinecone(pinecone_instance, vectors)
-
-        def retrieve_github_documents(github_token, repo_name, branch='documents', path=None):
-            """Retrieve documents from a GitHub repository."""
-            g = Github(github_token)
-            repo = g.get_repo(repo_name)
-            contents = repo.get_contents(path or "", ref=branch)
-            documents = []
-
-            while contents:
-                file_content = contents.pop(0)
-                if file_content.type == 'file' and file_content.path.endswith('.pdf'):
-                    content_file = repo.get_contents(file_content.path, ref=branch)
-                    file_content_data = base64.b64decode(content_file.content)
-                    documents.append({"file_path": file_content.path, "file_content": file_content_data})
-                elif file_content.type == 'dir':
-                    contents.extend(repo.get_contents(file_content.path, ref=branch))
-
-            return documents
-
-        def initialize_pinecone(api_key, index_name):
-            """Initialize a Pinecone instance."""
-            pc = Pinecone(api_key=api_key)
-            index = pc.Index(index_name)
-            return index
-
-        def is_pinecone_index_empty(index):
-            """Check if a Pinecone index is empty."""
-            response = index.describe_index_stats()
-            return response['namespaces']['ns1']['vector_count'] == 0
-
-        def store_vectors_in_pinecone(index, vectors):
-            """Store vectors in the Pinecone index."""
-            index.upsert(vectors=vectors, namespace="ns1")
-
-        def query_pinecone_index(index, query_vector, top_k=3):
-            """Query the Pinecone index."""
-            response = index.query(
-                namespace="ns1",
-                vector=query_vector,
-                top_k=top_k,
-                include_values=False,
-                include_metadata=True
-            )
-            return response['matches']
+        # Questions only search the documents of the chosen theme (and the shared ones)
+        rag_chat_theme = st.selectbox("Thème des documents :", [ALL_THEMES] + THEMES, key="rag_chat_theme")
 
         # Load environment variables
         #load_environment_variables([['env', '.env']]) directement inclu avec streamlit cloud
@@ -502,10 +492,10 @@ else:
             'github_branch': os.getenv('GITHUB_BRANCH', 'documents')
         }
 
-         # Initialize Pinecone
-        pinecone_index = initialize_pinecone(env_variables['pinecone_key'], env_variables['pinecone_index'])
+        # The shared Pinecone index is opened on the first question (see the chat input handler)
 
         # Check if Pinecone index is empty and process if necessary
+        # (ingestion runs outside the app: `python ingest.py --source github`, see ingest.py)
         # if is_pinecone_index_empty(pinecone_index):
         #     st.info("Waking up instance and loading documents...")
 
@@ -533,18 +523,31 @@ else:
                 temperature = st.slider('Creativity -/+:', min_value=0.01, max_value=1.0, value=0.8, step=0.01)
                 top_p = st.slider('Words randomness -/+:', min_value=0.01, max_value=1.0, value=0.95, step=0.01)
                 freq_penalty = st.slider('Frequency Penalty -/+:', min_value=-1.99, max_value=1.99, value=0.0, step=0.01)
-                max_length = st.slider('Max Length', min_value=256, max_value=8192, value=4224, step=2)
+                # Bounded by the model's answer cap: a longer request would be cut down anyway
+                answer_cap = MODEL_LIMITS.get(selected_model, DEFAULT_LIMITS)["answer"]
+                max_length = st.slider('Max Length', min_value=256, max_value=answer_cap, value=min(1024, answer_cap), step=2)
+                stream_responses = st.toggle('Stream responses', value=True)
 
-            st.button('Clear Chat History', on_click=lambda: st.session_state.update({'messages': [{"role": "assistant", "content": "Posez vos questions relatives à la participation citoyenne et aux sciences politiques !"}]}))
+            st.button('Clear Chat History', on_click=new_conversation)
 
         # Maintain chat history
-        if "messages" not in st.session_state:
-            st.session_state["messages"] = [{"role": "assistant", "content": "Posez vos questions relatives à la participation citoyenne et aux sciences politiques !"}]
-
-        # Display the chat history
-        for message in st.session_state['messages']:
-            with st.chat_message(message["role"]):
-                st.write(message.get("content", ""))  # Use get to avoid KeyError
+        if "conversation_id" not in st.session_state:
+            new_conversation()
+
+        # Display the chat history: the latest messages, plus older pages read back on demand
+        with trace("streamlit.history"):
+            messages = st.session_state['messages']
+            first_seq = messages[0]["seq"] if messages else st.session_state["message_seq"]
+            shown = st.session_state["older_messages_shown"]
+            older = storage.list_chat_messages(st.session_state["conversation_id"], first_seq, shown) if shown else []
+            if first_seq - len(older) > 0:
+                st.button(
+                    "Afficher les messages précédents",
+                    on_click=lambda: st.session_state.update({"older_messages_shown": shown + CHAT_PAGE_SIZE}),
+                )
+            for message in older + messages:
+                with st.chat_message(message["role"]):
+                    st.write(message.get("content", ""))  # Use get to avoid KeyError
 
         # Define model parameters
         model_params = {
@@ -556,29 +559,94 @@ else:
         }
 
         # Chat input handling
-        if user_input := st.chat_input(placeholder="Qu'est-ce que la participation citoyenne ?"):
+        if user_input := st.chat_input(placeholder="Qu'est-ce que la participation citoyenne ?", key="chat_question", on_submit=prefetch_question):
+            # What the model remembers of the conversation so far (before this question)
+            memory = st.session_state["memory"]
+            history = memory.prompt_messages(model_params['selected_model'])
+
             # Record user message
-            st.session_state.messages.append({"role": "user", "content": user_input})
+            record_chat_message("user", user_input)
             st.write(f"**User:** {user_input}")
 
+            # Shared Pinecone index: built once per process, reused by every rerun and session
+            pinecone_index = initialize_pinecone(env_variables['pinecone_key'], env_variables['pinecone_index'])
+
+            turn_started = time.perf_counter()
+
+            # Started by prefetch_question; start it now if the callback did not run
+            pending = st.session_state.pop("pending_question", None)
+            if pending is None or pending.question != user_input or pending.theme != rag_chat_theme:
+                pending = PendingQuestion(user_input, theme=rag_chat_theme)
+            # Answers are only reused for questions asked over the same documents
+            cache_scope = (tuple(pending.namespaces), MUNICIPALITY)
+
             with st.spinner("Thinking . . . "):
-                # Get the embedding for the user prompt
-                query_vector = get_embedding(user_input)
-                
-                # Query the Pinecone index
-                results = query_pinecone_index(pinecone_index, query_vector)
-                
-                # Compile summaries from queried results
-                all_summaries = "\n".join([
-                    f"File: {item.metadata['file_path']} - Summary: {item.metadata['summary']} - Score: {item['score']}"
-                    for item in results if item.metadata
-                ]) if results else "No relevant information found."
-                
-                # Refine the response based on available summaries
-                refined_response = refine_response(all_summaries, user_input)
-                
-                # Display the assistant's response
+                # Embedding of the user prompt (None if it missed its deadline)
+                query_vector = pending.query_vector()
+
+                # Near-duplicate questions reuse a previous answer: no retrieval, no generation
+                answer_cache = get_answer_cache()
+                cached_response = None
+                # Follow-ups depend on the conversation, so only opening questions use the cache
+                is_opening_question = not (history[0] or history[1])
+                if query_vector is not None and is_opening_question:
+                    cached_response = answer_cache.lookup(query_vector, index_version(pinecone_index), cache_scope)
+
+                if cached_response is None:
+                    # Query the vector index and the keyword index together, each within its deadline
+                    results = pending.matches(pinecone_index, query_vector)
+
+                    # Deduped, reranked summaries packed into the selected model's token budget
+                    all_summaries, max_tokens = assemble_context(
+                        user_input, results or [], model_params['selected_model'], model_params['max_length']
+                    )
+
+            if cached_response is not None:
+                refined_response = cached_response
                 st.write(f"**Assistant:** {refined_response}")
+            else:
+                # Wait for a generation slot, shared fairly between every session of the process
+                queue_notice = st.empty()
+
+                def show_position(position):
+                    queue_notice.info(f"Beaucoup de questions en ce moment : vous êtes n°{position} dans la file d'attente…")
+
+                estimate = estimate_tokens(
+                    history[1], texts=[history[0], all_summaries, user_input], max_tokens=max_tokens, model=model_params['selected_model']
+                )
+                with llm_slot(model_params['selected_model'], estimate, on_wait=show_position):
+                    queue_notice.empty()
+                    # Refine the response based on available summaries
+                    if stream_responses:
+                        # Render tokens as they arrive; write_stream returns the full text
+                        with st.chat_message("assistant"):
+                            refined_response = st.write_stream(stream_answer(all_summaries, user_input, model_params['selected_model'], max_tokens, history))
+                    else:
+                        with st.spinner("Thinking . . . "):
+                            refined_response = refine_answer(all_summaries, user_input, model_params['selected_model'], max_tokens, history)
+
+                        # Display the assistant's response
+                        st.write(f"**Assistant:** {refined_response}")
+
+            if pending.timed_out:
+                st.caption(f"Réponse construite à partir de résultats partiels ({', '.join(pending.timed_out)} : délai dépassé).")
+
+            if query_vector is not None and is_opening_question and cached_response is None and "Refinement error:" not in refined_response:
+                answer_cache.put(query_vector, user_input, refined_response, index_version(pinecone_index), cache_scope)
 
             # Append assistant's response to chat history
-            st.session_state.messages.append({"role": "assistant", "content": refined_response})
+            record_chat_message("assistant", refined_response)
+            get_metrics().observe("chat.turn", time.perf_counter() - turn_started)
+
+# Startup timing report (admin only)
+if st.session_state["is_admin"]:
+    with st.sidebar.expander("⏱️ Startup timings"):
+        st.write(f"Process up for {time.perf_counter() - PROCESS_STARTED:.0f} s, this rerun took {(time.perf_counter() - rerun_started) * 1000:.0f} ms")
+        st.dataframe([{"Module": name, "Import (ms)": round(ms, 1)} for name, ms in startup_report()], hide_index=True)
+
+    # Live pipeline metrics of this process (also exported in Prometheus format)
+    with st.sidebar.expander("📊 Chat metrics"):
+        st.dataframe(get_metrics().summary(), hide_index=True)
+        st.dataframe(get_metrics().counter_rows(), hide_index=True)
+
+get_metrics().observe("streamlit.rerun", time.perf_counter() - rerun_started)
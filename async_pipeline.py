@@ -0,0 +1,222 @@
+"""Async chat pipeline on one event loop shared by every session.
+
+Work for a question starts as soon as it is submitted (see ``PendingQuestion``), so the
+embedding and the keyword search run while Streamlit is still rendering the chat history.
+Every stage has a deadline: a slow stage is dropped instead of hanging the page.
+"""
+import os
+import time
+import queue
+import asyncio
+import threading
+
+from bm25 import get_bm25_index, reciprocal_rank_fusion
+from chunking import EMBEDDING_MODEL
+from clients import get_async_openai_client
+from embedding_cache import get_embedding_cache
+from metrics import trace, get_metrics
+from namespaces import namespaces_for, metadata_filter
+from rag import HYBRID_CANDIDATES, _refine_request, bm25_filter, merge_top_k, query_pinecone_index
+from scheduler import allm_slot, awith_backoff, estimate_tokens, current_context, restore_context
+
+# Seconds allowed per stage, counted from the moment the stage starts
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "5"))
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "3"))
+GENERATION_TIMEOUT = float(os.getenv("GENERATION_TIMEOUT", "60"))  # until the first / next token when streaming
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """Return the process-wide event loop, running in a background thread."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-pipeline", daemon=True).start()
+        return _loop
+
+
+def submit(coroutine):
+    """Schedule a coroutine on the shared loop and return a concurrent.futures.Future.
+
+    The coroutine runs in the caller's scheduler context, so its OpenAI calls queue for
+    the caller's session.
+    """
+    context = current_context()
+
+    async def run():
+        restore_context(context)
+        return await coroutine
+
+    return asyncio.run_coroutine_threadsafe(run(), get_event_loop())
+
+
+async def aget_embedding(text, model=EMBEDDING_MODEL):
+    """Async get_embedding, sharing the same embedding cache."""
+    cache = get_embedding_cache()
+    cached = cache.get(model, text)
+    if cached is not None:
+        return cached
+    async with allm_slot(model, estimate_tokens(texts=[text])) as ticket:
+        with trace("openai.embedding") as span:
+            response = await awith_backoff(
+                lambda: get_async_openai_client().embeddings.create(model=model, input=text, encoding_format="float"), model
+            )
+            span.usage = ticket.usage = response.usage
+    embedding = response.data[0].embedding
+    cache.put(model, text, embedding)
+    return embedding
+
+
+async def _with_deadline(awaitable, deadline, fallback):
+    """Result of awaitable, or fallback if it fails or is not done by deadline (monotonic time)."""
+    try:
+        return await asyncio.wait_for(awaitable, max(0.0, deadline - time.monotonic()))
+    except Exception:
+        return fallback
+
+
+def _lexical_matches(question, top_k, filter):
+    """BM25 matches, or None when no keyword index has been built yet."""
+    bm25_index = get_bm25_index()
+    if bm25_index is None:
+        return None
+    with trace("bm25.search"):
+        return bm25_index.search(question, top_k, filter)
+
+
+class PendingQuestion:
+    """A chat question whose embedding and keyword search are already running.
+
+    ``timed_out`` lists the stages that failed or missed their deadline, so the page can
+    say that the answer was built from partial results.
+    """
+
+    def __init__(self, question, top_k=3, theme=None):
+        self.question = question
+        self.top_k = top_k
+        self.theme = theme
+        self.namespaces = namespaces_for(theme)
+        self.filter = metadata_filter()
+        self.timed_out = []
+        self.started = time.monotonic()
+        self._embedding = submit(aget_embedding(question))
+        self._lexical = submit(asyncio.to_thread(
+            _lexical_matches, question, max(top_k, HYBRID_CANDIDATES), bm25_filter(self.namespaces, self.filter)
+        ))
+
+    def query_vector(self):
+        """The question embedding, or None if it failed or missed EMBEDDING_TIMEOUT."""
+        try:
+            return self._embedding.result(max(0.0, self.started + EMBEDDING_TIMEOUT - time.monotonic()))
+        except Exception:
+            self._embedding.cancel()
+            if "embedding" not in self.timed_out:
+                self.timed_out.append("embedding")
+                get_metrics().increment("deadline_exceeded_total", stage="embedding")
+            return None
+
+    def matches(self, index, query_vector):
+        """Vector matches of every namespace and keyword matches, gathered concurrently within
+        RETRIEVAL_TIMEOUT, then fused."""
+        return submit(self._amatches(index, query_vector)).result()
+
+    async def _amatches(self, index, query_vector):
+        deadline = time.monotonic() + RETRIEVAL_TIMEOUT
+        candidates = max(self.top_k, HYBRID_CANDIDATES)
+        lexical = _with_deadline(asyncio.wrap_future(self._lexical), self.started + RETRIEVAL_TIMEOUT, False)
+        shards = [] if query_vector is None else [
+            _with_deadline(
+                asyncio.to_thread(query_pinecone_index, index, query_vector, candidates, namespace, self.filter),
+                deadline,
+                False,
+            )
+            for namespace in self.namespaces
+        ]
+        lexical_matches, *shard_matches = await asyncio.gather(lexical, *shards)
+
+        if lexical_matches is False:
+            self.timed_out.append("lexical")
+            get_metrics().increment("deadline_exceeded_total", stage="lexical")
+        if any(matches is False for matches in shard_matches):
+            # Late shards are left out; the others still answer
+            self.timed_out.append("vector")
+            get_metrics().increment("deadline_exceeded_total", stage="vector")
+        vector_matches = merge_top_k([matches for matches in shard_matches if matches is not False], candidates)
+        if not lexical_matches:
+            return vector_matches[:self.top_k]
+        return reciprocal_rank_fusion([vector_matches, lexical_matches], top_k=self.top_k)
+
+
+async def arefine_response(text, prompt, model="gpt-4o", max_length=1024, history=None):
+    """Async refine_response, giving up after GENERATION_TIMEOUT."""
+    request = _refine_request(text, prompt, model, max_length, history)
+    try:
+        async with allm_slot(model, estimate_tokens(request["messages"], max_tokens=max_length)) as ticket:
+            with trace("openai.generation") as span:
+                # The deadline covers the retries, not the time spent queued for a slot
+                response = await asyncio.wait_for(
+                    awith_backoff(lambda: get_async_openai_client().chat.completions.create(**request), model),
+                    GENERATION_TIMEOUT,
+                )
+                span.usage = ticket.usage = response.usage
+        return response.choices[0].message.content
+    except asyncio.TimeoutError:
+        get_metrics().increment("deadline_exceeded_total", stage="generation")
+        return f"Refinement error: no answer within {GENERATION_TIMEOUT:g}s"
+    except Exception as e:
+        return f"Refinement error: {str(e)}"
+
+
+def refine_answer(text, prompt, model="gpt-4o", max_length=1024, history=None):
+    """Generate the answer on the shared loop (blocking call for the Streamlit thread)."""
+    return submit(arefine_response(text, prompt, model, max_length, history)).result()
+
+
+def stream_answer(text, prompt, model="gpt-4o", max_length=1024, history=None):
+    """Yield answer tokens streamed on the shared loop; stops if the model stalls past GENERATION_TIMEOUT."""
+    tokens = queue.Queue()
+
+    request = _refine_request(text, prompt, model, max_length, history)
+
+    async def produce():
+        try:
+            async with allm_slot(model, estimate_tokens(request["messages"], max_tokens=max_length)) as ticket:
+                started = time.perf_counter()
+                with trace("openai.generation_stream") as span:
+                    stream = await awith_backoff(lambda: get_async_openai_client().chat.completions.create(
+                        **request,
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    ), model)
+                    first_token = None
+                    async for chunk in stream:
+                        if chunk.usage:
+                            span.usage = ticket.usage = chunk.usage
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            if first_token is None:
+                                first_token = time.perf_counter()
+                                get_metrics().observe("openai.first_token", first_token - started)
+                            tokens.put(chunk.choices[0].delta.content)
+        except Exception as e:
+            tokens.put(f"Refinement error: {str(e)}")
+        finally:
+            tokens.put(None)
+
+    future = submit(produce())
+    try:
+        while True:
+            try:
+                token = tokens.get(timeout=GENERATION_TIMEOUT)
+            except queue.Empty:
+                get_metrics().increment("deadline_exceeded_total", stage="generation")
+                yield f"Refinement error: no answer within {GENERATION_TIMEOUT:g}s"
+                return
+            if token is None:
+                return
+            yield token
+    finally:
+        # Also reached when the page stops consuming the stream
+        future.cancel()
@@ -0,0 +1,391 @@
+"""Offline benchmark of the chat pipeline against local stand-ins for OpenAI and Pinecone.
+
+No API key is needed: a fake OpenAI server (embeddings and chat completions) runs on
+localhost and the vector index is a local index wrapped with injected latency and
+errors. Results go to JSON so two versions can be compared::
+
+    python benchmark.py --requests 500 --concurrency 16 --output before.json
+    python benchmark.py --requests 500 --concurrency 16 --output after.json --compare before.json
+    python benchmark.py --workloads embed,chat --openai-latency 0.3 --error-rate 0.05 --no-cache
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORKLOADS = ["chunk", "embed", "query", "refine", "chat"]
+WORDS = (
+    "participation citoyenne budget projet quartier mairie conseil vote consultation école "
+    "mobilité vélo parc environnement déchets énergie logement transport sécurité culture "
+    "association habitants réunion proposition débat démocratie locale commune élus"
+).split()
+
+
+def fake_embedding(text, dimension):
+    """Deterministic pseudo embedding of a text."""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    return [rng.uniform(-1.0, 1.0) for _ in range(dimension)]
+
+
+def synthetic_text(rng, words):
+    """Sentences of plausible vocabulary, ``words`` words long."""
+    sentences, sentence = [], []
+    for _ in range(words):
+        sentence.append(rng.choice(WORDS))
+        if len(sentence) >= rng.randint(8, 20):
+            sentences.append(" ".join(sentence).capitalize() + ".")
+            sentence = []
+    if sentence:
+        sentences.append(" ".join(sentence).capitalize() + ".")
+    return " ".join(sentences)
+
+
+class Faults:
+    """Latency (mean seconds, +/- jitter fraction) and error rate injected into a stand-in."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def delay(self):
+        if self.latency:
+            time.sleep(max(0.0, random.uniform(1 - self.jitter, 1 + self.jitter) * self.latency))
+
+    def fails(self):
+        return random.random() < self.error_rate
+
+
+def make_openai_server(faults, dimension, error_status=500):
+    """Fake OpenAI API on a free localhost port; returns the server and its base URL."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            faults.delay()
+            if faults.fails():
+                self._json(error_status, {"error": {"message": "injected failure", "type": "server_error"}})
+                return
+
+            if self.path.endswith("/embeddings"):
+                inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+                tokens = sum(len(text.split()) for text in inputs)
+                self._json(200, {
+                    "object": "list",
+                    "model": request["model"],
+                    "data": [
+                        {"object": "embedding", "index": i, "embedding": fake_embedding(text, dimension)}
+                        for i, text in enumerate(inputs)
+                    ],
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                })
+                return
+
+            prompt = request["messages"][-1]["content"]
+            answer = "Réponse de test : " + " ".join(prompt.split()[:40])
+            usage = {"prompt_tokens": len(prompt.split()), "completion_tokens": len(answer.split()),
+                     "total_tokens": len(prompt.split()) + len(answer.split())}
+            if request.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for word in answer.split():
+                    chunk = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": request["model"],
+                             "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    # Last chunk carries the usage, which settles the scheduler's token estimate
+                    chunk = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": request["model"],
+                             "choices": [], "usage": usage}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+                return
+            self._json(200, {
+                "id": "bench",
+                "object": "chat.completion",
+                "created": 0,
+                "model": request["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+class FakeVectorIndex:
+    """Pinecone-compatible index (a LocalIndex) with injected latency and errors."""
+
+    def __init__(self, index, faults):
+        self.index = index
+        self.faults = faults
+
+    def _call(self, method, *args, **kwargs):
+        self.faults.delay()
+        if self.faults.fails():
+            raise ConnectionError("injected vector index failure")
+        return getattr(self.index, method)(*args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        return self._call("query", *args, **kwargs)
+
+    def upsert(self, *args, **kwargs):
+        return self._call("upsert", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call("delete", *args, **kwargs)
+
+    def describe_index_stats(self):
+        return self._call("describe_index_stats")
+
+    @property
+    def version(self):
+        return self.index.version
+
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of a sorted list."""
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+def run_workload(call, requests, concurrency):
+    """Run call(i) for i in range(requests) on `concurrency` threads; latency and throughput summary."""
+    latencies, errors = [], {}
+    lock = threading.Lock()
+
+    def one(i):
+        started = time.perf_counter()
+        try:
+            call(i)
+            failed = None
+        except Exception as e:
+            failed = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if failed:
+                errors[failed] = errors.get(failed, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "error_rate": sum(errors.values()) / requests if requests else 0.0,
+        "wall_s": round(wall, 4),
+        "throughput_rps": round(requests / wall, 2) if wall else None,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+            "p50": round(percentile(ordered, 0.5) * 1000, 3),
+            "p95": round(percentile(ordered, 0.95) * 1000, 3),
+            "p99": round(percentile(ordered, 0.99) * 1000, 3),
+            "max": round(ordered[-1] * 1000, 3),
+        } if ordered else {},
+    }
+
+
+class RefinementFailed(Exception):
+    """The answer functions report errors as text; the benchmark counts them as failures."""
+
+
+class PartialResults(Exception):
+    """A retrieval stage missed its deadline: the page would show a partial-results answer."""
+
+
+def build_workloads(args, workdir):
+    """Configure the pipeline against the stand-ins and return {name: call(i)}."""
+    # Imported here: the pipeline modules read their configuration from the environment
+    from rag import chunk_text, get_embedding, query_pinecone_index
+    from async_pipeline import PendingQuestion, refine_answer, stream_answer
+    from context import assemble_context
+    from local_index import LocalIndex
+    from bm25 import add_to_corpus, rebuild_index
+
+    rng = random.Random(args.seed)
+    document = synthetic_text(rng, args.document_words)
+    questions = [synthetic_text(rng, 12) for _ in range(args.unique_questions)]
+
+    # Seed the index and the keyword corpus directly, without going through the fake API
+    index = FakeVectorIndex(LocalIndex(os.path.join(workdir, "index")), Faults(args.vector_latency, args.jitter, args.error_rate))
+    records = []
+    for i in range(args.corpus_size):
+        text = synthetic_text(rng, 60)
+        records.append((f"doc{i // 10}_{i % 10}", text, {"file_path": f"doc{i // 10}.pdf", "summary": text[:200]}))
+    index.index.upsert([
+        {"id": record_id, "values": fake_embedding(text, args.dimension), "metadata": metadata}
+        for record_id, text, metadata in records
+    ])
+    add_to_corpus(records)
+    rebuild_index()
+    context = "\n".join(f"File: {metadata['file_path']} - Summary: {metadata['summary']}" for _, _, metadata in records[:3])
+    query_vectors = [fake_embedding(question, args.dimension) for question in questions]
+
+    def refine(question):
+        answer = refine_answer(context, question)
+        if "Refinement error:" in answer:
+            raise RefinementFailed(answer)
+        return answer
+
+    def chat(i):
+        # The app's path: deadlines on the shared event loop, context packing and a consumed
+        # stream (the answer cache is left out, it would measure repeated questions only)
+        question = questions[i % len(questions)]
+        pending = PendingQuestion(question, theme=args.theme)
+        matches = pending.matches(index, pending.query_vector())
+        text, max_tokens = assemble_context(question, matches or [])
+        answer = "".join(stream_answer(text, question, max_length=max_tokens))
+        if "Refinement error:" in answer:
+            raise RefinementFailed(answer)
+        if pending.timed_out:
+            raise PartialResults(", ".join(pending.timed_out))
+        return answer
+
+    return {
+        "chunk": lambda i: chunk_text(document),
+        "embed": lambda i: get_embedding(questions[i % len(questions)]),
+        "query": lambda i: query_pinecone_index(index, query_vectors[i % len(query_vectors)]),
+        "refine": lambda i: refine(questions[i % len(questions)]),
+        "chat": chat,
+    }
+
+
+def git_version():
+    try:
+        completed = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True)
+        return completed.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline, current, tolerance):
+    """Print the change of each workload against a baseline; return the regressed workloads."""
+    regressions = []
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if not before or not before.get("latency_ms") or not result.get("latency_ms"):
+            continue
+        line = [f"{name:<7}"]
+        for key in ("p50", "p95", "p99"):
+            old, new = before["latency_ms"][key], result["latency_ms"][key]
+            change = (new - old) / old if old else 0.0
+            line.append(f"{key} {old:9.2f} -> {new:9.2f} ms ({change:+.0%})")
+            if key == "p95" and change > tolerance:
+                regressions.append(name)
+        old, new = before["throughput_rps"], result["throughput_rps"]
+        line.append(f"throughput {old} -> {new} req/s")
+        print("  ".join(line), file=sys.stderr)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chat pipeline offline.")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help=f"comma-separated subset of {', '.join(WORKLOADS)}")
+    parser.add_argument("--requests", type=int, default=200, help="calls per workload")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--openai-latency", type=float, default=0.05, help="mean seconds per fake OpenAI request")
+    parser.add_argument("--vector-latency", type=float, default=0.01, help="mean seconds per fake index call")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency varies by +/- this fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stand-in calls that fail")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of injected OpenAI failures (e.g. 429)")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--corpus-size", type=int, default=2000, help="chunks seeded in the index")
+    parser.add_argument("--document-words", type=int, default=20000, help="size of the document chunked by 'chunk'")
+    parser.add_argument("--unique-questions", type=int, default=50, help="fewer questions means more cache hits")
+    parser.add_argument("--theme", help="restrict the chat workload to one theme's namespaces (default: fan out to all)")
+    parser.add_argument("--no-cache", action="store_true", help="disable the embedding cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p95 increase that counts as a regression")
+    args = parser.parse_args(argv)
+
+    workloads = [name.strip() for name in args.workloads.split(",") if name.strip()]
+    unknown = set(workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+    random.seed(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix="voxpopuli-bench-")
+    server, base_url = make_openai_server(Faults(args.openai_latency, args.jitter, args.error_rate), args.dimension,
+                                          args.error_status)
+    # Point every pipeline module at the stand-ins before they are imported
+    os.environ.update({
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": "benchmark",
+        "BM25_DIR": os.path.join(workdir, "bm25"),
+        "EMBEDDING_CACHE_PATH": "" if args.no_cache else os.path.join(workdir, "embeddings.sqlite3"),
+        "METRICS_PATH": os.path.join(workdir, "metrics.prom"),
+        "INDEX_VERSION_PATH": os.path.join(workdir, "index_version"),
+    })
+    if args.no_cache:
+        os.environ["EMBEDDING_CACHE_MEMORY_ENTRIES"] = "0"
+
+    calls = build_workloads(args, workdir)
+    from metrics import get_metrics
+
+    # One untimed call each so lazy imports and connection setup are not measured
+    for name in workloads:
+        try:
+            calls[name](0)
+        except Exception:
+            pass
+
+    results = {}
+    for name in workloads:
+        results[name] = run_workload(calls[name], args.requests, args.concurrency)
+        latency = results[name]["latency_ms"]
+        print(f"{name:<7} {results[name]['throughput_rps']:>9} req/s  p50 {latency['p50']:9.2f} ms  "
+              f"p95 {latency['p95']:9.2f} ms  p99 {latency['p99']:9.2f} ms  errors {results[name]['error_rate']:.1%}",
+              file=sys.stderr)
+    server.shutdown()
+
+    report = {
+        "version": git_version(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "tolerance")},
+        "results": results,
+        "stages": get_metrics().summary(),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions:
+            print(f"p95 regression over {args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
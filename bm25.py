@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import threading
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from local_index import Match, _hashable
+
+BM25_DIR = os.getenv("BM25_DIR", "index/bm25")
+K1 = 1.2
+B = 0.75
+# Metadata keys chat questions filter on, dictionary-encoded so a filter is a NumPy mask
+FILTER_KEYS = ("namespace", "municipality")
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "au aux avec ce ces dans de des du elle en et eux il ils je la le les leur lui ma mais me meme mes moi mon "
+    "ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton tu un une vos votre vous "
+    "c d j l m n s t y est sont a ete etre avoir fait comment quoi quel quelle quels quelles the of and to in is".split()
+)
+
+
+def tokenize(text):
+    """Lowercase, accent-free word tokens without French stopwords ("École" -> "ecole")."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char)).casefold()
+    return [token for token in _TOKEN.findall(text) if token not in STOPWORDS]
+
+
+def _files(path):
+    return os.path.join(path, "postings.npz"), os.path.join(path, "documents.json"), os.path.join(path, "corpus.jsonl")
+
+
+def _wanted(condition):
+    """Values a plain, $eq or $in condition accepts."""
+    if not isinstance(condition, dict):
+        return [condition]
+    return condition.get("$in", [condition.get("$eq")])
+
+
+def _accepts(metadata, filter):
+    """Whether metadata passes a Pinecone-style filter (plain values, $eq and $in)."""
+    for key, condition in filter.items():
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        if "$eq" in condition and value != condition["$eq"]:
+            return False
+        if "$in" in condition and value not in condition["$in"]:
+            return False
+    return True
+
+
+class BM25Index:
+    """Okapi BM25 over precomputed postings stored as flat NumPy arrays (CSR layout).
+
+    For term t, ``docs[offsets[t]:offsets[t + 1]]`` are the documents containing it and
+    ``weights[...]`` their length-normalized term frequencies, so a query is a handful of
+    vectorized adds.
+    """
+
+    def __init__(self, vocabulary, offsets, docs, weights, idf, ids, metadata):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self.idf = idf
+        self.ids = ids
+        self.metadata = metadata
+        # key -> (value -> code, int32 code per row); a missing key is encoded as None
+        self.columns = {}
+        for key in FILTER_KEYS:
+            lookup, codes = {}, np.empty(len(metadata), dtype=np.int32)
+            for row, row_metadata in enumerate(metadata):
+                codes[row] = lookup.setdefault(_hashable(row_metadata.get(key)), len(lookup))
+            self.columns[key] = (lookup, codes)
+
+    def mask(self, filter):
+        """Boolean row mask for a Pinecone-style filter ($eq and $in)."""
+        mask = np.ones(len(self.ids), dtype=bool)
+        for key, condition in filter.items():
+            if key in self.columns:
+                lookup, codes = self.columns[key]
+                known = [lookup[value] for value in map(_hashable, _wanted(condition)) if value in lookup]
+                mask &= np.isin(codes, known)
+            else:
+                # Keys outside FILTER_KEYS fall back to a per-row check
+                mask &= np.array([_accepts(row_metadata, {key: condition}) for row_metadata in self.metadata], dtype=bool)
+        return mask
+
+    @classmethod
+    def build(cls, records):
+        """Build from (id, text, metadata) records."""
+        ids, metadata, term_counts = [], [], []
+        for record_id, text, record_metadata in records:
+            ids.append(record_id)
+            metadata.append(record_metadata or {})
+            term_counts.append(Counter(tokenize(text)))
+
+        lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) else 0.0
+        postings = {}
+        for doc, counts in enumerate(term_counts):
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc, tf))
+
+        vocabulary = {term: term_id for term_id, term in enumerate(sorted(postings))}
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        docs, tfs = [], []
+        for term in sorted(postings):
+            entries = postings[term]
+            offsets[vocabulary[term] + 1] = offsets[vocabulary[term]] + len(entries)
+            docs.extend(doc for doc, _ in entries)
+            tfs.extend(tf for _, tf in entries)
+
+        docs = np.array(docs, dtype=np.int32)
+        tfs = np.array(tfs, dtype=np.float32)
+        norms = K1 * (1 - B + B * lengths[docs] / (average_length or 1.0)) if len(docs) else tfs
+        weights = (tfs * (K1 + 1) / (tfs + norms)).astype(np.float32)
+        document_frequency = np.diff(offsets).astype(np.float32)
+        idf = np.log(1 + (len(ids) - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        return cls(vocabulary, offsets, docs, weights, idf, ids, metadata)
+
+    def search(self, query, top_k=3, filter=None):
+        """Top-k matches for a text query, shaped like vector index matches."""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # Document ids are unique within a posting list, so a plain fancy-index add is safe
+            scores[self.docs[start:end]] += self.idf[term_id] * self.weights[start:end]
+
+        if filter:
+            scores[~self.mask(filter)] = 0
+        candidates = np.flatnonzero(scores)
+        if not len(candidates):
+            return []
+        k = min(top_k, len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [Match(id=self.ids[row], score=float(scores[row]), metadata=self.metadata[row]) for row in top]
+
+    def save(self, path=BM25_DIR):
+        postings_file, documents_file, _ = _files(path)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        with open(postings_file + ".tmp", "wb") as f:
+            np.savez(f, offsets=self.offsets, docs=self.docs, weights=self.weights, idf=self.idf)
+        with open(documents_file + ".tmp", "w", encoding="utf-8") as f:
+            terms = sorted(self.vocabulary, key=self.vocabulary.get)
+            json.dump({"terms": terms, "ids": self.ids, "metadata": self.metadata}, f, ensure_ascii=False)
+        # Postings last: get_bm25_index reloads when their mtime changes
+        os.replace(documents_file + ".tmp", documents_file)
+        os.replace(postings_file + ".tmp", postings_file)
+
+    @classmethod
+    def load(cls, path=BM25_DIR):
+        postings_file, documents_file, _ = _files(path)
+        arrays = np.load(postings_file)
+        with open(documents_file, encoding="utf-8") as f:
+            documents = json.load(f)
+        docs = arrays["docs"]
+        if len(arrays["offsets"]) != len(documents["terms"]) + 1 or (len(docs) and docs.max() >= len(documents["ids"])):
+            # Caught between the two replaces of a save: the postings are from the previous one
+            raise ValueError(f"BM25 files in {path} are from different saves")
+        vocabulary = {term: term_id for term_id, term in enumerate(documents["terms"])}
+        return cls(vocabulary, arrays["offsets"], docs, arrays["weights"], arrays["idf"],
+                   documents["ids"], documents["metadata"])
+
+
+# Ingestion side: chunk texts are kept in a JSONL corpus so the index can be rebuilt after
+# incremental updates without re-reading the PDFs.
+
+def add_to_corpus(records, path=BM25_DIR):
+    """Append (id, text, metadata) records to the corpus."""
+    if not os.path.exists(path):
+        os.makedirs(path)
+    with open(_files(path)[2], "a", encoding="utf-8") as f:
+        for record_id, text, metadata in records:
+            f.write(json.dumps({"id": record_id, "text": text, "metadata": metadata}, ensure_ascii=False) + "\n")
+
+
+def remove_from_corpus(ids, path=BM25_DIR):
+    """Drop records from the corpus (documents deleted or re-ingested)."""
+    corpus_file = _files(path)[2]
+    ids = set(ids)
+    if not ids or not os.path.exists(corpus_file):
+        return
+    with open(corpus_file, encoding="utf-8") as source, open(corpus_file + ".tmp", "w", encoding="utf-8") as target:
+        for line in source:
+            if json.loads(line)["id"] not in ids:
+                target.write(line)
+    os.replace(corpus_file + ".tmp", corpus_file)
+
+
+def rebuild_index(path=BM25_DIR):
+    """Rebuild and save the BM25 index from the corpus; later records win over earlier ones."""
+    corpus_file = _files(path)[2]
+    if not os.path.exists(corpus_file):
+        return None
+    records = {}
+    with open(corpus_file, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            records[record["id"]] = (record["id"], record["text"], record["metadata"])
+    index = BM25Index.build(records.values())
+    index.save(path)
+    return index
+
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def get_bm25_index(path=BM25_DIR):
+    """Process-wide BM25 index, reloaded when ingestion rewrites it; None if never built."""
+    postings_file = _files(path)[0]
+    try:
+        mtime = os.path.getmtime(postings_file)
+    except OSError:
+        return None
+    with _loaded_lock:
+        cached = _loaded.get(path)
+        if cached is None or cached[0] != mtime:
+            try:
+                cached = _loaded[path] = (mtime, BM25Index.load(path))
+            except ValueError:
+                # A save is in progress: keep serving the previous index until it completes
+                return cached[1] if cached else None
+        return cached[1]
+
+
+def reciprocal_rank_fusion(result_lists, top_k=3, k=60):
+    """Merge ranked match lists: each list contributes 1 / (k + rank) per match."""
+    fused, metadata = {}, {}
+    for results in result_lists:
+        for rank, match in enumerate(results):
+            fused[match["id"]] = fused.get(match["id"], 0.0) + 1.0 / (k + rank + 1)
+            # Pinecone returns ScoredVector objects, the local indexes plain Match dicts
+            metadata[match["id"]] = metadata.get(match["id"]) or getattr(match, "metadata", None) or {}
+    best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+    return [Match(id=match_id, score=fused[match_id], metadata=metadata[match_id]) for match_id in best]
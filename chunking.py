@@ -0,0 +1,112 @@
+import re
+import threading
+
+from lazy_imports import timed_import
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+CHUNK_TOKENS = 512
+CHUNK_OVERLAP = 64
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+_WORD_PIECES = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(model=EMBEDDING_MODEL):
+    """Return the tiktoken encoding of a model, or None when tiktoken is unavailable."""
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                _encodings[model] = timed_import("tiktoken").encoding_for_model(model)
+            except Exception:
+                # Not installed, or the encoding file can't be downloaded (offline)
+                _encodings[model] = None
+        return _encodings[model]
+
+
+def count_tokens(text, model=EMBEDDING_MODEL):
+    """Number of tokens the model will see for this text."""
+    encoding = get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Approximation without tiktoken: one token per word piece, plus one per 4 extra characters
+    return sum(1 + max(len(piece) - 4, 0) // 4 for piece in _WORD_PIECES.findall(text))
+
+
+def _split_oversized(unit, max_tokens, model):
+    """Hard-split a single sentence/paragraph that does not fit in one chunk."""
+    encoding = get_encoding(model)
+    if encoding is not None:
+        tokens = encoding.encode(unit, disallowed_special=())
+        for start in range(0, len(tokens), max_tokens):
+            piece = encoding.decode(tokens[start:start + max_tokens]).strip()
+            if piece:
+                yield piece
+        return
+    piece, piece_tokens = [], 0
+    words = (word[i:i + max_tokens * 4] for word in unit.split() for i in range(0, len(word), max_tokens * 4))
+    for word in words:
+        word_tokens = count_tokens(word, model)
+        if piece and piece_tokens + word_tokens > max_tokens:
+            yield " ".join(piece)
+            piece, piece_tokens = [], 0
+        piece.append(word)
+        piece_tokens += word_tokens
+    if piece:
+        yield " ".join(piece)
+
+
+def _iter_units(stream, boundary):
+    """Yield sentences or paragraphs from text arriving in pieces."""
+    pattern = _PARAGRAPH_BREAK if boundary == "paragraph" else _SENTENCE_END
+    buffer = ""
+    for piece in stream:
+        buffer += piece
+        parts = pattern.split(buffer)
+        # The last part may continue in the next piece
+        buffer = parts.pop()
+        for part in parts:
+            part = " ".join(part.split())
+            if part:
+                yield part
+    buffer = " ".join(buffer.split())
+    if buffer:
+        yield buffer
+
+
+def iter_chunks(text, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP, boundary="sentence", model=EMBEDDING_MODEL):
+    """Yield chunks of at most max_tokens tokens, cut on sentence or paragraph boundaries.
+
+    ``text`` may be a string or any iterable of strings (e.g. OCR pages). Consecutive
+    chunks share up to ``overlap`` tokens of trailing units.
+    """
+    if overlap >= max_tokens:
+        raise ValueError("overlap must be smaller than max_tokens")
+    stream = [text] if isinstance(text, str) else text
+
+    window, window_tokens = [], 0
+    for unit in _iter_units(stream, boundary):
+        unit_tokens = count_tokens(unit, model)
+        pieces = [(unit, unit_tokens)]
+        if unit_tokens > max_tokens:
+            pieces = [(piece, count_tokens(piece, model)) for piece in _split_oversized(unit, max_tokens, model)]
+
+        for piece, piece_tokens in pieces:
+            if window and window_tokens + piece_tokens > max_tokens:
+                yield " ".join(chunk for chunk, _ in window)
+                # Carry the trailing units that fit in the overlap into the next chunk
+                carried, carried_tokens = [], 0
+                for kept, kept_tokens in reversed(window):
+                    if carried_tokens + kept_tokens > overlap or carried_tokens + kept_tokens + piece_tokens > max_tokens:
+                        break
+                    carried.insert(0, (kept, kept_tokens))
+                    carried_tokens += kept_tokens
+                window, window_tokens = carried, carried_tokens
+            window.append((piece, piece_tokens))
+            window_tokens += piece_tokens
+
+    if window:
+        yield " ".join(chunk for chunk, _ in window)
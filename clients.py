@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+from lazy_imports import lazy_import
+
+# Loaded on first use so importing this module stays cheap at cold start
+httpx = lazy_import("httpx")
+openai = lazy_import("openai")
+pinecone = lazy_import("pinecone")
+
+# Shared by every Streamlit session running in this process
+MAX_CONNECTIONS = int(os.getenv("VOXPOPULI_MAX_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = 60  # seconds an idle connection stays in the pool
+PINECONE_POOL_THREADS = int(os.getenv("VOXPOPULI_PINECONE_POOL_THREADS", "4"))
+HEALTH_CHECK_INTERVAL = 30  # seconds between two Pinecone health checks
+
+_openai_lock = threading.Lock()
+_pinecone_lock = threading.Lock()
+_openai_clients = {}
+_async_openai_clients = {}
+_pinecone_indexes = {}
+
+
+def get_openai_client(api_key=None):
+    """Return the process-wide OpenAI client for an API key."""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    with _openai_lock:
+        client = _openai_clients.get(api_key)
+        if client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(60.0, connect=5.0),
+            )
+            client = openai.OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+            _openai_clients[api_key] = client
+        return client
+
+
+def get_async_openai_client(api_key=None):
+    """Return the process-wide async OpenAI client for an API key.
+
+    Async clients are bound to one event loop: only use this from the shared loop of
+    async_pipeline.
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    with _openai_lock:
+        client = _async_openai_clients.get(api_key)
+        if client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(60.0, connect=5.0),
+            )
+            client = openai.AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+            _async_openai_clients[api_key] = client
+        return client
+
+
+def _connect_pinecone(api_key, index_name):
+    """Open a new Pinecone index handle with a pooled connection."""
+    pc = pinecone.Pinecone(api_key=api_key, pool_threads=PINECONE_POOL_THREADS)
+    return pc.Index(index_name, pool_threads=PINECONE_POOL_THREADS)
+
+
+def _is_healthy(index):
+    """Check that a Pinecone index still answers."""
+    try:
+        index.describe_index_stats()
+        return True
+    except Exception:
+        return False
+
+
+def get_pinecone_index(api_key, index_name):
+    """Return the process-wide Pinecone index, reconnecting if it went stale."""
+    key = (api_key, index_name)
+    with _pinecone_lock:
+        entry = _pinecone_indexes.get(key)
+        if entry is None:
+            entry = {"index": _connect_pinecone(api_key, index_name), "checked_at": time.monotonic()}
+            _pinecone_indexes[key] = entry
+            return entry["index"]
+        if time.monotonic() - entry["checked_at"] < HEALTH_CHECK_INTERVAL:
+            return entry["index"]
+        # Mark as checked first so concurrent reruns don't all probe at once
+        entry["checked_at"] = time.monotonic()
+        index = entry["index"]
+
+    if _is_healthy(index):
+        return index
+    return reconnect_pinecone_index(index)
+
+
+def reconnect_pinecone_index(index):
+    """Replace a failing Pinecone index handle with a fresh one."""
+    with _pinecone_lock:
+        for (api_key, index_name), entry in _pinecone_indexes.items():
+            if entry["index"] is index:
+                entry["index"] = _connect_pinecone(api_key, index_name)
+                entry["checked_at"] = time.monotonic()
+                return entry["index"]
+    return None
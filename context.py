@@ -0,0 +1,101 @@
+import os
+
+from bm25 import tokenize
+from chunking import count_tokens
+
+# Context window, largest completion and longest chat answer of each chat model (tokens).
+# The answer cap is what a summary of CONTEXT_TOKENS of passages needs: it bounds the
+# Max Length slider, and so the tokens each call reserves in the scheduler's quota.
+MODEL_LIMITS = {
+    "gpt-4o": {"window": 128000, "output": 16384, "answer": 2048},
+    "o1-mini": {"window": 128000, "output": 65536, "answer": 2048},
+    "gpt-3.5-turbo": {"window": 16385, "output": 4096, "answer": 1024},
+}
+DEFAULT_LIMITS = {"window": 16385, "output": 4096, "answer": 1024}
+# Retrieved context sent per question: a few well-chosen passages answer better, and faster,
+# than everything the window could hold
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "3000"))
+PROMPT_OVERHEAD = 200  # instructions, question framing and message separators
+DUPLICATE_SIMILARITY = 0.8  # token-set Jaccard above which two passages say the same thing
+RETRIEVAL_WEIGHT = 0.5  # share of the rerank score from the retriever, the rest from term coverage
+# o1 models spend completion tokens on hidden reasoning before answering
+REASONING_MODELS = ("o1",)
+REASONING_TOKENS = 4096  # headroom added to their completion cap
+
+
+def is_reasoning_model(model):
+    """o1 models take no system message and count reasoning in max_completion_tokens."""
+    return model.startswith(REASONING_MODELS)
+
+
+def _passage(match):
+    metadata = getattr(match, "metadata", None) or {}
+    return metadata.get("file_path", ""), metadata.get("summary", "")
+
+
+def dedupe(matches):
+    """Drop repeated ids and passages whose words mostly repeat a better-ranked one."""
+    kept, kept_terms, seen = [], [], set()
+    for match in matches:
+        if match["id"] in seen:
+            continue
+        seen.add(match["id"])
+        terms = set(tokenize(_passage(match)[1]))
+        if any(terms and len(terms & other) / len(terms | other) >= DUPLICATE_SIMILARITY for other in kept_terms):
+            continue
+        kept.append(match)
+        kept_terms.append(terms)
+    return kept
+
+
+def rerank(question, matches):
+    """Order matches by retriever score blended with how many question terms each passage covers."""
+    if not matches:
+        return []
+    question_terms = set(tokenize(question))
+    scores = [float(match["score"] or 0.0) for match in matches]
+    low, high = min(scores), max(scores)
+
+    def cross_score(item):
+        position, match = item
+        retrieval = (scores[position] - low) / (high - low) if high > low else 1.0
+        file_path, summary = _passage(match)
+        coverage = len(question_terms & set(tokenize(f"{file_path} {summary}"))) / len(question_terms) if question_terms else 0.0
+        return RETRIEVAL_WEIGHT * retrieval + (1 - RETRIEVAL_WEIGHT) * coverage
+
+    return [match for _, match in sorted(enumerate(matches), key=cross_score, reverse=True)]
+
+
+def output_tokens(model, requested):
+    """Completion token cap: the requested length, within the model's answer cap and what it
+    can produce."""
+    limits = MODEL_LIMITS.get(model, DEFAULT_LIMITS)
+    requested = min(requested, limits["answer"])
+    if is_reasoning_model(model):
+        requested += REASONING_TOKENS
+    return max(1, min(requested, limits["output"], limits["window"] - PROMPT_OVERHEAD - CONTEXT_TOKENS))
+
+
+def assemble_context(question, matches, model="gpt-4o", max_output_tokens=1024):
+    """Deduped, reranked passages packed into the model's token budget.
+
+    Returns the context text and the completion token cap to request.
+    """
+    max_tokens = output_tokens(model, max_output_tokens)
+    limits = MODEL_LIMITS.get(model, DEFAULT_LIMITS)
+    budget = min(CONTEXT_TOKENS, limits["window"] - max_tokens - PROMPT_OVERHEAD - count_tokens(question, model))
+
+    lines, used = [], 0
+    for match in rerank(question, dedupe(matches)):
+        file_path, summary = _passage(match)
+        if not summary:
+            continue
+        line = f"File: {file_path} - Summary: {summary}"
+        tokens = count_tokens(line, model) + 1
+        # Skip what doesn't fit: a shorter, lower-ranked passage may still do
+        if used + tokens > budget:
+            continue
+        lines.append(line)
+        used += tokens
+
+    return ("\n".join(lines) if lines else "No relevant information found."), max_tokens
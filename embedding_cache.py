@@ -0,0 +1,115 @@
+import os
+import re
+import time
+import array
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from metrics import record_cache
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite3")
+MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "2048"))
+DISK_ENTRIES = int(os.getenv("EMBEDDING_CACHE_DISK_ENTRIES", "200000"))
+
+
+def normalize_text(text):
+    """Normalize text so trivially different inputs share a cache key."""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(model, text):
+    """Hash of the model name and the normalized text."""
+    payload = f"{model}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache: in-memory LRU in front of a SQLite store."""
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, memory_entries=MEMORY_ENTRIES, disk_entries=DISK_ENTRIES):
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            folder = os.path.dirname(path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._db.commit()
+            self._disk_count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _remember(self, key, vector):
+        """Insert into the in-memory LRU, evicting the least recently used entry."""
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, model, text):
+        """Return the cached embedding, or None on a miss."""
+        key = cache_key(model, text)
+        with self._lock:
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory.move_to_end(key)
+                record_cache("embedding", True)
+                return vector
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = array.array("f", row[0]).tolist()
+                    self._db.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    self._remember(key, vector)
+                    record_cache("embedding", True)
+                    return vector
+            record_cache("embedding", False)
+            return None
+
+    def put(self, model, text, vector):
+        """Store an embedding in both tiers."""
+        key = cache_key(model, text)
+        with self._lock:
+            self._remember(key, list(vector))
+            if self._db is None:
+                return
+            inserted = self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                (key, model, array.array("f", vector).tobytes(), time.time()),
+            ).rowcount
+            self._disk_count += inserted
+            if self._disk_count > self.disk_entries:
+                # Evict in one statement, keeping a 10% margin so this doesn't run on every insert
+                excess = self._disk_count - int(self.disk_entries * 0.9)
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._disk_count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._db.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Return the process-wide embedding cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
@@ -0,0 +1,106 @@
+import os
+import json
+import base64
+
+from lazy_imports import lazy_import
+
+github = lazy_import("github")
+
+MANIFEST_PATH = os.getenv("GITHUB_MANIFEST_PATH", "cache/github_manifest.json")
+DOCUMENTS_DIR = os.getenv("DOCUMENTS_DIR", "cache/documents")
+
+
+def open_github_repo(github_token, repo_name, base_url=None):
+    """Open a repository; base_url points PyGithub at another API (GitHub Enterprise or a local stand-in)."""
+    base_url = base_url or os.getenv("GITHUB_API_URL")
+    g = github.Github(github_token, base_url=base_url) if base_url else github.Github(github_token)
+    return g.get_repo(repo_name)
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """Load the path -> blob SHA manifest of the last sync."""
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    """Write the manifest atomically."""
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _walk_tree(repo, sha, prefix, base=""):
+    """Yield (path, blob SHA) under a tree one level at a time, for trees too large to list recursively."""
+    tree = repo.get_git_tree(sha)
+    if tree.truncated:
+        raise RuntimeError(f"GitHub truncated the listing of {base or '/'}: too many entries to sync safely")
+    for element in tree.tree:
+        element_path = base + element.path
+        if element.type == "tree":
+            # Only descend into the folders leading to, or inside, the synced path
+            if not prefix or prefix.startswith(element_path + "/") or (element_path + "/").startswith(prefix + "/"):
+                yield from _walk_tree(repo, element.sha, prefix, element_path + "/")
+        elif element.type == "blob":
+            yield element_path, element.sha
+
+
+def list_remote_pdfs(repo, branch="documents", path=None):
+    """Map every PDF on the branch to its blob SHA, with one recursive trees call unless
+    GitHub truncates it."""
+    commit_sha = repo.get_branch(branch).commit.sha
+    tree = repo.get_git_tree(commit_sha, recursive=True)
+    prefix = (path or "").strip("/")
+    if tree.truncated:
+        # A partial listing would make the missing PDFs look removed: walk the sub-trees instead
+        blobs = _walk_tree(repo, commit_sha, prefix)
+    else:
+        blobs = ((element.path, element.sha) for element in tree.tree if element.type == "blob")
+    return {
+        blob_path: sha
+        for blob_path, sha in blobs
+        if blob_path.endswith(".pdf") and (not prefix or blob_path.startswith(prefix + "/"))
+    }
+
+
+def download_blob(repo, sha, target_path):
+    """Write one blob straight to disk instead of keeping it in memory."""
+    folder = os.path.dirname(target_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    blob = repo.get_git_blob(sha)
+    with open(target_path + ".tmp", "wb") as f:
+        f.write(base64.b64decode(blob.content) if blob.encoding == "base64" else blob.content.encode("utf-8"))
+    os.replace(target_path + ".tmp", target_path)
+
+
+def sync_github_documents(repo, branch="documents", path=None, dest_dir=DOCUMENTS_DIR, manifest_path=MANIFEST_PATH):
+    """Bring dest_dir in line with the branch, downloading only added or changed PDFs.
+
+    Returns {"added": [...], "changed": [...], "removed": [...]} as repository paths.
+    """
+    manifest = load_manifest(manifest_path)
+    remote = list_remote_pdfs(repo, branch, path)
+    changes = {"added": [], "changed": [], "removed": sorted(set(manifest) - set(remote))}
+
+    for file_path, sha in sorted(remote.items()):
+        if manifest.get(file_path) == sha:
+            continue
+        changes["changed" if file_path in manifest else "added"].append(file_path)
+        download_blob(repo, sha, os.path.join(dest_dir, file_path))
+        manifest[file_path] = sha
+        # Save as we go so an interrupted sync does not download the same files again
+        save_manifest(manifest, manifest_path)
+
+    for file_path in changes["removed"]:
+        local_path = os.path.join(dest_dir, file_path)
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        del manifest[file_path]
+    save_manifest(manifest, manifest_path)
+    return changes
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import threading
+
+import numpy as np
+
+from chunking import EMBEDDING_MODEL
+from local_index import _normalize
+from rag import get_embeddings
+
+IDEA_INDEX_PATH = os.getenv("IDEA_INDEX_PATH", "cache/ideas")
+SIMILAR_THRESHOLD = float(os.getenv("IDEA_SIMILAR_THRESHOLD", "0.6"))  # shown as related to a new idea
+DUPLICATE_THRESHOLD = float(os.getenv("IDEA_DUPLICATE_THRESHOLD", "0.85"))  # treated as the same idea
+CLUSTER_BLOCK_ROWS = 1024  # rows compared at once when clustering, to bound memory
+# Lookups run on every rerun of the ideas page: fail fast, then leave the API alone for a while
+LOOKUP_TIMEOUT = float(os.getenv("IDEA_LOOKUP_TIMEOUT", "3"))
+LOOKUP_COOLDOWN = float(os.getenv("IDEA_LOOKUP_COOLDOWN", "60"))
+
+
+def idea_text(title, description):
+    """Text embedded for an announcement."""
+    return f"{title}\n\n{description}"
+
+
+class IdeaIndex:
+    """Normalized embedding of every announcement, appended to as new ones are published.
+
+    Persisted as a .npy matrix plus the announcement id of each row, so a restart never
+    re-embeds the corpus.
+    """
+
+    def __init__(self, path=IDEA_INDEX_PATH, model=EMBEDDING_MODEL):
+        self.path = path
+        self.model = model
+        self.matrix = None
+        self.ids = []
+        self.rows = {}
+        self._clusters = None  # (row count, threshold, clusters) of the last clustering
+        self._unavailable_until = 0.0  # monotonic time before which embedding calls are skipped
+        self._lock = threading.Lock()
+        if path:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self._load()
+
+    def _files(self):
+        return os.path.join(self.path, "ideas.npy"), os.path.join(self.path, "ideas.json")
+
+    def _load(self):
+        matrix_file, meta_file = self._files()
+        if not (os.path.exists(matrix_file) and os.path.exists(meta_file)):
+            return
+        with open(meta_file, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["model"] != self.model:
+            return  # embeddings of another model can't be compared: start over
+        self.matrix = np.load(matrix_file)
+        self.ids = meta["ids"]
+        self.rows = {announcement_id: row for row, announcement_id in enumerate(self.ids)}
+
+    def _save(self):
+        if not self.path:
+            return
+        matrix_file, meta_file = self._files()
+        # Write to temporary files first so a crash never leaves a half-written index
+        with open(matrix_file + ".tmp", "wb") as f:
+            np.save(f, self.matrix)
+        os.replace(matrix_file + ".tmp", matrix_file)
+        with open(meta_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "ids": self.ids}, f)
+        os.replace(meta_file + ".tmp", meta_file)
+
+    def _embed_all(self, texts):
+        """Embeddings with a short timeout and no retries; raises without calling the API
+        during the cooldown that follows a failure."""
+        if time.monotonic() < self._unavailable_until:
+            raise RuntimeError("embedding API unavailable, retried after the cooldown")
+        try:
+            return get_embeddings(texts, model=self.model, retries=0, timeout=LOOKUP_TIMEOUT)
+        except Exception:
+            self._unavailable_until = time.monotonic() + LOOKUP_COOLDOWN
+            raise
+
+    def sync(self, announcements):
+        """Embed the announcements not indexed yet, in one batch, and append them."""
+        with self._lock:
+            missing = [a for a in announcements if a["id"] not in self.rows]
+        if not missing:
+            return 0
+        # Ideas checked at submission are served from the embedding cache
+        vectors = _normalize(self._embed_all([idea_text(a["title"], a["desc"]) for a in missing]))
+        with self._lock:
+            new = [(a["id"], vector) for a, vector in zip(missing, vectors) if a["id"] not in self.rows]
+            if not new:
+                return 0
+            rows = np.stack([vector for _, vector in new])
+            self.matrix = rows if self.matrix is None else np.vstack([self.matrix, rows])
+            for announcement_id, _ in new:
+                self.rows[announcement_id] = len(self.ids)
+                self.ids.append(announcement_id)
+            self._save()
+            return len(new)
+
+    def embed(self, title, description):
+        """Normalized embedding of an idea that may not be published yet."""
+        return _normalize(self._embed_all([idea_text(title, description)]))[0]
+
+    def similar(self, vector, top_k=3, threshold=SIMILAR_THRESHOLD):
+        """Up to top_k (announcement id, cosine similarity) pairs above threshold, best first."""
+        with self._lock:
+            matrix, ids = self.matrix, list(self.ids)
+        if matrix is None:
+            return []
+        scores = matrix[:len(ids)] @ vector
+        top = np.argsort(-scores)[:top_k]
+        return [(ids[row], float(scores[row])) for row in top if scores[row] >= threshold]
+
+    def clusters(self, threshold=DUPLICATE_THRESHOLD):
+        """Groups of two or more announcement ids linked by similarity above threshold.
+
+        Pairs are joined with union-find, so A~B and B~C put A, B and C together. The
+        result is kept until new announcements are indexed.
+        """
+        with self._lock:
+            matrix, ids = self.matrix, list(self.ids)
+            cached = self._clusters
+        if matrix is None:
+            return []
+        if cached is not None and cached[:2] == (len(ids), threshold):
+            return cached[2]
+
+        parent = list(range(len(ids)))
+
+        def find(row):
+            while parent[row] != row:
+                parent[row] = parent[parent[row]]
+                row = parent[row]
+            return row
+
+        for start in range(0, len(ids), CLUSTER_BLOCK_ROWS):
+            block = matrix[start:start + CLUSTER_BLOCK_ROWS] @ matrix[:len(ids)].T
+            for i, j in zip(*np.nonzero(block >= threshold)):
+                a, b = find(start + i), find(j)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+
+        groups = {}
+        for row in range(len(ids)):
+            groups.setdefault(find(row), []).append(ids[row])
+        clusters = [group for group in groups.values() if len(group) > 1]
+        with self._lock:
+            self._clusters = (len(ids), threshold, clusters)
+        return clusters
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_idea_index():
+    """Return the process-wide idea index."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = IdeaIndex()
+        return _index
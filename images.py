@@ -0,0 +1,105 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from lazy_imports import lazy_import
+
+Image = lazy_import("PIL.Image")
+ImageOps = lazy_import("PIL.ImageOps")
+
+IMAGE_FOLDER = "images"
+THUMBNAIL_FOLDER = os.path.join(IMAGE_FOLDER, "thumbs")
+THUMBNAIL_WIDTH = 320  # the feed column is ~1/6 of the page; 320px stays sharp on HiDPI screens
+THUMBNAIL_CACHE_BYTES = int(os.getenv("THUMBNAIL_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+_cache = OrderedDict()  # (path, width, mtime) -> encoded thumbnail bytes
+_cache_size = 0
+_cache_lock = threading.Lock()
+
+
+def save_upload(data, original_name, folder=IMAGE_FOLDER):
+    """Store an uploaded image under a content-hash name and pre-build its thumbnail.
+
+    Raises ValueError, and keeps nothing, if the file is not an image PIL can read.
+    """
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    extension = os.path.splitext(original_name)[1].lower() or ".jpg"
+    path = os.path.join(folder, hashlib.sha256(data).hexdigest()[:16] + extension)
+    # Same bytes, same name: identical uploads are stored once and never overwrite another image
+    if not os.path.exists(path):
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+    try:
+        make_thumbnail(path)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        # UnidentifiedImageError and truncated files are OSErrors
+        for leftover in (path, thumbnail_path(path) + ".tmp"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise ValueError(f"{original_name} is not a readable image") from e
+    return path
+
+
+def _thumbnail_format():
+    Image.init()  # registers every format plugin PIL can load, WebP only with its codec
+    return ("WEBP", ".webp") if "WEBP" in Image.SAVE else ("JPEG", ".jpg")
+
+
+def thumbnail_path(path, width=THUMBNAIL_WIDTH):
+    """Where the thumbnail of an image is written."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(THUMBNAIL_FOLDER, f"{stem}_{width}{_thumbnail_format()[1]}")
+
+
+def make_thumbnail(path, width=THUMBNAIL_WIDTH):
+    """Write a downscaled WebP (or JPEG) copy of an image and return its path."""
+    target = thumbnail_path(path, width)
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+        return target
+    if not os.path.exists(THUMBNAIL_FOLDER):
+        os.makedirs(THUMBNAIL_FOLDER)
+
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((width, width * 4))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        image_format, _ = _thumbnail_format()
+        if image_format == "JPEG":
+            image = image.convert("RGB")
+        image.save(target + ".tmp", format=image_format, quality=80)
+    os.replace(target + ".tmp", target)
+    return target
+
+
+def thumbnail_bytes(path, width=THUMBNAIL_WIDTH, mtime=None):
+    """Encoded thumbnail of an image, kept in a byte-bounded LRU cache; None if the image is missing.
+
+    Pass the image mtime when already known to skip the stat call.
+    """
+    global _cache_size
+    try:
+        key = (path, width, mtime if mtime is not None else os.path.getmtime(path))
+    except OSError:
+        return None
+
+    with _cache_lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+            return data
+
+    with open(make_thumbnail(path, width), "rb") as f:
+        data = f.read()
+
+    with _cache_lock:
+        if key not in _cache:
+            _cache[key] = data
+            _cache_size += len(data)
+        while _cache_size > THUMBNAIL_CACHE_BYTES and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            _cache_size -= len(evicted)
+    return data
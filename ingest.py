@@ -0,0 +1,255 @@
+"""Document ingestion: OCR, chunking, summaries, embeddings and upserts.
+
+Run outside Streamlit, e.g.::
+
+    python ingest.py --source github
+    python ingest.py --source github --sync
+    python ingest.py --source dir --path ./documents --workers 8
+    python ingest.py --source dir --path ./transport --theme Transport --municipality Lyon
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from rag import (
+    extract_text_from_pdf,
+    chunk_text,
+    summarize_text,
+    get_embeddings,
+    initialize_pinecone,
+    retrieve_github_documents,
+    store_vectors_in_pinecone,
+    delete_vectors_from_pinecone,
+)
+from bm25 import add_to_corpus, remove_from_corpus, rebuild_index
+from namespaces import THEMES, SHARED_NAMESPACE, namespace_for, document_metadata
+from github_sync import DOCUMENTS_DIR, open_github_repo, load_manifest, sync_github_documents
+from scheduler import with_backoff
+
+CHECKPOINT_PATH = os.getenv("INGEST_CHECKPOINT_PATH", "cache/ingest_checkpoint.json")
+UPSERT_BATCH_SIZE = 100
+VECTOR_SERVICE = "vector_index"  # label of the vector index calls in the retry metrics
+OCR_AHEAD = 2  # documents OCR'd ahead per worker
+
+
+def document_key(file_path):
+    """Stable vector id prefix for a document, so re-runs overwrite instead of duplicating."""
+    return hashlib.sha1(file_path.encode("utf-8")).hexdigest()[:16]
+
+
+def load_checkpoint(path=CHECKPOINT_PATH):
+    """Load the ingestion checkpoint, or an empty one."""
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {"documents": {}}
+
+
+def save_checkpoint(checkpoint, path=CHECKPOINT_PATH):
+    """Write the checkpoint atomically."""
+    if not path:
+        return
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def upsert_in_batches(index, vectors, batch_size=UPSERT_BATCH_SIZE, namespace=SHARED_NAMESPACE):
+    """Upsert vectors in fixed-size batches, retrying each batch on failure."""
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        with_backoff(lambda: store_vectors_in_pinecone(index, batch, namespace), VECTOR_SERVICE)
+
+
+def summarize_chunk(chunk):
+    """Summary of one chunk; raises instead of returning summarize_text's error string, which
+    would otherwise be indexed as knowledge."""
+    summary = summarize_text(chunk)
+    if summary.startswith("Summary error:"):
+        raise RuntimeError(summary)
+    return summary
+
+
+def build_vectors(document, text, pool, extra_metadata=None):
+    """Chunk, summarize (in the pool) and embed (batched) one document's text.
+
+    Returns the vectors and the matching (id, chunk text, metadata) records for the BM25 corpus.
+    """
+    chunks = chunk_text(text)
+    summaries = list(pool.map(summarize_chunk, chunks))
+    embeddings = get_embeddings(chunks)  # retried per batch by the scheduler's backoff
+    key = document_key(document["file_path"])
+    vectors = [
+        {
+            "id": f"{key}_{i}",
+            "values": embedding,
+            "metadata": dict(extra_metadata or {}, file_path=document["file_path"], summary=summary),
+        }
+        for i, (embedding, summary) in enumerate(zip(embeddings, summaries))
+    ]
+    records = [(vector["id"], chunk, vector["metadata"]) for vector, chunk in zip(vectors, chunks)]
+    return vectors, records
+
+
+def read_document(document):
+    """PDF bytes of a document, read from disk when it was synced rather than held in memory."""
+    if "file_content" in document:
+        return document["file_content"]
+    with open(document["local_path"], "rb") as f:
+        return f.read()
+
+
+def print_progress(done, total, file_path, chunks):
+    """Default progress reporter for the CLI."""
+    print(f"[{done}/{total}] {file_path}: {chunks} chunks", file=sys.stderr, flush=True)
+
+
+def process_and_store_documents(repo_docs, pinecone_instance, workers=4, checkpoint_path=CHECKPOINT_PATH,
+                                batch_size=UPSERT_BATCH_SIZE, progress=print_progress, theme=None, municipality=None):
+    """Process documents and store them in Pinecone, resuming from the checkpoint.
+
+    Documents go to the theme's namespace (the shared one without a theme) and are tagged
+    with the theme and municipality for filtering.
+    """
+    namespace = namespace_for(theme)
+    metadata = document_metadata(theme, municipality)
+    checkpoint = load_checkpoint(checkpoint_path)
+    done_documents = checkpoint["documents"]
+    pending = [doc for doc in repo_docs if doc["file_path"] not in done_documents]
+    total, done, failed = len(pending), 0, []
+
+    with ThreadPoolExecutor(max_workers=workers) as ocr_pool, ThreadPoolExecutor(max_workers=workers) as pool:
+        # OCR runs a bounded window ahead while earlier documents are summarized and embedded,
+        # so only a few texts per worker are held in memory at once
+        ocr = lambda doc: extract_text_from_pdf(read_document(doc))
+        upcoming = iter(pending)
+        texts = deque(ocr_pool.submit(ocr, doc) for doc in islice(upcoming, workers * OCR_AHEAD))
+        for document in pending:
+            text = texts.popleft()
+            for doc in islice(upcoming, 1):
+                texts.append(ocr_pool.submit(ocr, doc))
+            try:
+                vectors, records = build_vectors(document, text.result(), pool, metadata)
+                upsert_in_batches(pinecone_instance, vectors, batch_size, namespace)
+            except Exception as e:
+                # Not checkpointed: the next run retries the document
+                print(f"{document['file_path']}: {e}", file=sys.stderr, flush=True)
+                failed.append(document["file_path"])
+                continue
+            add_to_corpus((record_id, chunk, dict(record_metadata, namespace=namespace))
+                          for record_id, chunk, record_metadata in records)
+
+            done_documents[document["file_path"]] = {
+                "ids": [vector["id"] for vector in vectors],
+                "sha": document.get("sha"),
+                "namespace": namespace,
+            }
+            save_checkpoint(checkpoint, checkpoint_path)
+            done += 1
+            if progress:
+                progress(done, total, document["file_path"], len(vectors))
+
+    if done:
+        rebuild_index()
+    if failed:
+        print(f"{len(failed)} documents failed and stay pending", file=sys.stderr)
+    return checkpoint
+
+
+def sync_and_ingest(repo, index, branch="documents", path=None, checkpoint_path=CHECKPOINT_PATH, **kwargs):
+    """Incremental GitHub ingestion: re-index only PDFs whose blob SHA changed, drop removed ones."""
+    changes = sync_github_documents(repo, branch, path)
+    manifest = load_manifest()
+    checkpoint = load_checkpoint(checkpoint_path)
+
+    # Compare against the checkpoint rather than `changes` so an interrupted run still converges
+    removed_ids = []
+    for file_path, entry in list(checkpoint["documents"].items()):
+        if manifest.get(file_path) != entry.get("sha"):
+            with_backoff(lambda: delete_vectors_from_pinecone(index, entry["ids"], entry.get("namespace", SHARED_NAMESPACE)),
+                         VECTOR_SERVICE)
+            removed_ids.extend(entry["ids"])
+            del checkpoint["documents"][file_path]
+    remove_from_corpus(removed_ids)
+    save_checkpoint(checkpoint, checkpoint_path)
+
+    documents = [
+        {"file_path": file_path, "local_path": os.path.join(DOCUMENTS_DIR, file_path), "sha": sha}
+        for file_path, sha in sorted(manifest.items())
+        if file_path not in checkpoint["documents"]
+    ]
+    process_and_store_documents(documents, index, checkpoint_path=checkpoint_path, **kwargs)
+    if removed_ids and not documents:
+        rebuild_index()
+    return changes
+
+
+def iter_directory_documents(folder):
+    """Yield PDF documents found under a local folder."""
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if name.endswith(".pdf"):
+                full_path = os.path.join(root, name)
+                with open(full_path, "rb") as f:
+                    yield {"file_path": os.path.relpath(full_path, folder), "file_content": f.read()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest course documents into the vector index.")
+    parser.add_argument("--source", choices=["github", "dir"], default="github")
+    parser.add_argument("--path", help="folder of PDFs when --source dir")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=UPSERT_BATCH_SIZE)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and ingest everything")
+    parser.add_argument("--sync", action="store_true",
+                        help="with --source github, only fetch and re-index PDFs whose blob SHA changed")
+    parser.add_argument("--theme", choices=THEMES, help="store the documents in this theme's namespace")
+    parser.add_argument("--municipality", help="municipality the documents apply to (default: all)")
+    args = parser.parse_args(argv)
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    index = initialize_pinecone(os.getenv("PINECONE_API_KEY"), os.getenv("PINECONE_INDEX_NAME"))
+    started = time.monotonic()
+
+    if args.sync:
+        if args.source != "github":
+            parser.error("--sync only applies to --source github")
+        repo = open_github_repo(os.getenv("GITHUB_TOKEN"), os.getenv("GITHUB_REPO"))
+        changes = sync_and_ingest(
+            repo, index, os.getenv("GITHUB_BRANCH", "documents"), checkpoint_path=args.checkpoint,
+            workers=args.workers, batch_size=args.batch_size, theme=args.theme, municipality=args.municipality
+        )
+        print(f"{len(changes['added'])} added, {len(changes['changed'])} changed, {len(changes['removed'])} removed "
+              f"in {time.monotonic() - started:.1f}s", file=sys.stderr)
+        return
+
+    if args.source == "dir":
+        if not args.path:
+            parser.error("--path is required with --source dir")
+        documents = list(iter_directory_documents(args.path))
+    else:
+        documents = retrieve_github_documents(
+            os.getenv("GITHUB_TOKEN"), os.getenv("GITHUB_REPO"), os.getenv("GITHUB_BRANCH", "documents")
+        )
+
+    checkpoint = process_and_store_documents(
+        documents, index, workers=args.workers, checkpoint_path=args.checkpoint, batch_size=args.batch_size,
+        theme=args.theme, municipality=args.municipality
+    )
+    print(f"{len(checkpoint['documents'])} documents indexed in {time.monotonic() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
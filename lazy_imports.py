@@ -0,0 +1,66 @@
+import sys
+import time
+import importlib
+import threading
+import subprocess
+
+# Heavy dependencies that are only loaded on first use
+HEAVY_MODULES = ["openai", "pinecone", "github", "httpx", "pandas", "tiktoken", "PIL.Image"]
+
+IMPORT_TIMINGS = {}  # module name -> seconds spent importing it in this process
+PROCESS_STARTED = time.perf_counter()
+_lock = threading.Lock()
+
+
+def timed_import(name):
+    """Import a module, recording how long the first import took."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    with _lock:
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        IMPORT_TIMINGS.setdefault(name, time.perf_counter() - started)
+    return module
+
+
+class LazyModule:
+    """Module placeholder that imports the real module on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = timed_import(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name):
+    """Return a LazyModule for name (use like ``pd = lazy_import("pandas")``)."""
+    return LazyModule(name)
+
+
+def startup_report():
+    """Import timings of this process, slowest first, as (module, milliseconds) rows."""
+    return sorted(((name, seconds * 1000) for name, seconds in IMPORT_TIMINGS.items()), key=lambda row: -row[1])
+
+
+def measure_cold_imports(modules=HEAVY_MODULES):
+    """Cold import cost of each module, each measured in a fresh interpreter."""
+    results = {}
+    for name in modules:
+        code = f"import time; t = time.perf_counter(); import {name}; print(time.perf_counter() - t)"
+        completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        results[name] = float(completed.stdout) * 1000 if completed.returncode == 0 else None
+    return results
+
+
+if __name__ == "__main__":
+    for name, milliseconds in measure_cold_imports().items():
+        print(f"{name:<12} {'not installed' if milliseconds is None else f'{milliseconds:8.1f} ms'}")
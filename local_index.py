@@ -0,0 +1,264 @@
+import os
+import json
+import threading
+
+import numpy as np
+
+
+class Match(dict):
+    """Query match readable as ``item['score']`` and ``item.metadata``, like Pinecone's."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class _Namespace:
+    """Vectors of one namespace: a normalized float32 matrix plus columnar metadata."""
+
+    def __init__(self, dimension=None):
+        self.matrix = np.zeros((0, dimension or 0), dtype=np.float32)
+        self.ids = []
+        self.rows = {}
+        # Metadata is dictionary-encoded: one int32 code per row and per key, -1 when absent
+        self.keys = []
+        self.values = {}
+        self.lookup = {}
+        self.codes = np.zeros((0, 0), dtype=np.int32)
+
+    def metadata(self, row):
+        """Rebuild the metadata dict of one row."""
+        result = {}
+        for column, key in enumerate(self.keys):
+            code = self.codes[row, column]
+            if code >= 0:
+                result[key] = self.values[key][code]
+        return result
+
+    def encode(self, key, value):
+        """Return the code of a metadata value, adding it to the dictionary if new."""
+        if key not in self.values:
+            self.keys.append(key)
+            self.values[key] = []
+            self.codes = np.hstack([self.codes, np.full((self.codes.shape[0], 1), -1, dtype=np.int32)])
+        lookup = self.lookup.setdefault(key, {_hashable(v): code for code, v in enumerate(self.values[key])})
+        code = lookup.get(_hashable(value))
+        if code is None:
+            code = lookup[_hashable(value)] = len(self.values[key])
+            self.values[key].append(value)
+        return code
+
+    def mask(self, flt):
+        """Boolean row mask for a ``{key: value}`` or ``{key: {"$eq"|"$in": ...}}`` filter."""
+        mask = np.ones(len(self.ids), dtype=bool)
+        for key, condition in (flt or {}).items():
+            if key not in self.values:
+                return np.zeros(len(self.ids), dtype=bool)
+            if isinstance(condition, dict):
+                wanted = condition.get("$in", [condition.get("$eq")])
+            else:
+                wanted = [condition]
+            wanted = {_hashable(v) for v in wanted}
+            known = [code for code, v in enumerate(self.values[key]) if _hashable(v) in wanted]
+            mask &= np.isin(self.codes[:, self.keys.index(key)], known)
+        return mask
+
+
+def _hashable(value):
+    """Metadata values may be lists (Pinecone allows lists of strings)."""
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _normalize(vectors):
+    """L2-normalize rows so a dot product is a cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class LocalIndex:
+    """In-process replacement for a Pinecone index, persisted as memory-mapped .npy files."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.namespaces = {}
+        self.version = 0
+        self.signature = None  # what _signature(path) was when the files were last loaded or saved
+        self._lock = threading.Lock()
+        if path:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.signature = _signature(path)
+            self._load()
+
+    def _files(self, namespace):
+        base = os.path.join(self.path, namespace)
+        return base + ".npy", base + ".codes.npy", base + ".meta.json"
+
+    def _load(self):
+        for name in os.listdir(self.path):
+            if not name.endswith(".meta.json"):
+                continue
+            namespace = name[: -len(".meta.json")]
+            matrix_file, codes_file, meta_file = self._files(namespace)
+            with open(meta_file, encoding="utf-8") as f:
+                meta = json.load(f)
+            ns = _Namespace()
+            ns.matrix = np.load(matrix_file, mmap_mode="r")
+            ns.codes = np.load(codes_file)
+            if not len(ns.matrix) == len(ns.codes) == len(meta["ids"]):
+                # Read while another process was saving: skip it, the next get_local_index reloads
+                self.signature = None
+                continue
+            ns.ids = meta["ids"]
+            ns.rows = {vector_id: row for row, vector_id in enumerate(ns.ids)}
+            ns.keys = meta["keys"]
+            ns.values = meta["values"]
+            self.namespaces[namespace] = ns
+
+    def _save(self, namespace):
+        if not self.path:
+            return
+        ns = self.namespaces[namespace]
+        matrix_file, codes_file, meta_file = self._files(namespace)
+        # Write to temporary files first so a crash never leaves a half-written index
+        for target, array in ((matrix_file, ns.matrix), (codes_file, ns.codes)):
+            with open(target + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(target + ".tmp", target)
+        with open(meta_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"ids": ns.ids, "keys": ns.keys, "values": ns.values}, f, ensure_ascii=False)
+        os.replace(meta_file + ".tmp", meta_file)
+        ns.matrix = np.load(matrix_file, mmap_mode="r")
+        self.signature = _signature(self.path)  # our own save needs no reload
+
+    def upsert(self, vectors, namespace="ns1"):
+        """Insert or overwrite vectors given as Pinecone-style dicts or (id, values, metadata) tuples."""
+        if not vectors:
+            return {"upserted_count": 0}
+        records = [v if isinstance(v, dict) else dict(zip(("id", "values", "metadata"), v)) for v in vectors]
+        # One row per id, as in Pinecone: the last record of a repeated id wins
+        records = list({record["id"]: record for record in records}.values())
+        values = _normalize([record["values"] for record in records])
+
+        with self._lock:
+            ns = self.namespaces.get(namespace)
+            if ns is None:
+                ns = self.namespaces[namespace] = _Namespace(values.shape[1])
+            matrix = np.array(ns.matrix)  # writable copy of the memory map
+            new_rows = [record["id"] not in ns.rows for record in records]
+            added = sum(new_rows)
+            matrix = np.vstack([matrix, np.zeros((added, values.shape[1]), dtype=np.float32)])
+            ns.codes = np.vstack([ns.codes, np.full((added, len(ns.keys)), -1, dtype=np.int32)])
+
+            for record, vector, is_new in zip(records, values, new_rows):
+                if is_new:
+                    ns.rows[record["id"]] = len(ns.ids)
+                    ns.ids.append(record["id"])
+                row = ns.rows[record["id"]]
+                matrix[row] = vector
+                ns.codes[row] = -1
+                for key, value in (record.get("metadata") or {}).items():
+                    code = ns.encode(key, value)
+                    ns.codes[row, ns.keys.index(key)] = code
+
+            ns.matrix = matrix
+            self._save(namespace)
+            self.version += 1
+        return {"upserted_count": len(records)}
+
+    def delete(self, ids=None, delete_all=False, namespace="ns1"):
+        """Remove vectors by id, or the whole namespace."""
+        with self._lock:
+            ns = self.namespaces.get(namespace)
+            if ns is None:
+                return {}
+            if delete_all:
+                keep = np.zeros(len(ns.ids), dtype=bool)
+            else:
+                keep = np.ones(len(ns.ids), dtype=bool)
+                for vector_id in ids or []:
+                    if vector_id in ns.rows:
+                        keep[ns.rows[vector_id]] = False
+            ns.matrix = np.array(ns.matrix)[keep]
+            ns.codes = ns.codes[keep]
+            ns.ids = [vector_id for vector_id, kept in zip(ns.ids, keep) if kept]
+            ns.rows = {vector_id: row for row, vector_id in enumerate(ns.ids)}
+            self._save(namespace)
+            self.version += 1
+        return {}
+
+    def query_batch(self, vectors, namespace="ns1", top_k=3, include_values=False, include_metadata=True, filter=None):
+        """Top-k cosine matches for several query vectors with one matrix product."""
+        ns = self.namespaces.get(namespace)
+        queries = _normalize(np.atleast_2d(vectors))
+        if ns is None or not ns.ids:
+            return [[] for _ in queries]
+
+        scores = queries @ ns.matrix.T
+        if filter:
+            scores[:, ~ns.mask(filter)] = -np.inf
+        k = min(top_k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        results = []
+        for query_scores, candidates in zip(scores, top):
+            ordered = candidates[np.argsort(-query_scores[candidates])]
+            matches = []
+            for row in ordered:
+                if not np.isfinite(query_scores[row]):
+                    continue
+                match = Match(id=ns.ids[row], score=float(query_scores[row]))
+                if include_values:
+                    match["values"] = ns.matrix[row].tolist()
+                if include_metadata:
+                    match["metadata"] = ns.metadata(row)
+                matches.append(match)
+            results.append(matches)
+        return results
+
+    def query(self, vector, namespace="ns1", top_k=3, include_values=False, include_metadata=True, filter=None):
+        """Same call and response shape as ``pinecone.Index.query``."""
+        matches = self.query_batch([vector], namespace, top_k, include_values, include_metadata, filter)[0]
+        return {"matches": matches, "namespace": namespace}
+
+    def describe_index_stats(self):
+        """Vector counts per namespace, shaped like Pinecone's stats."""
+        namespaces = {name: {"vector_count": len(ns.ids)} for name, ns in self.namespaces.items()}
+        dimension = next((ns.matrix.shape[1] for ns in self.namespaces.values() if ns.ids), 0)
+        return {
+            "namespaces": namespaces,
+            "dimension": dimension,
+            "total_vector_count": sum(ns["vector_count"] for ns in namespaces.values()),
+        }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _signature(path):
+    """Modification times of the metadata files, which _save writes last."""
+    try:
+        return tuple(sorted(
+            (name, os.stat(os.path.join(path, name)).st_mtime_ns)
+            for name in os.listdir(path) if name.endswith(".meta.json")
+        ))
+    except OSError:
+        return None
+
+
+def get_local_index(path):
+    """Return the process-wide local index stored under ``path``, reloaded when another
+    process (e.g. ingest.py) has saved it since."""
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None or index.signature != _signature(path):
+            previous, index = index, LocalIndex(path)
+            if previous is not None:
+                index.version = previous.version + 1
+            _indexes[path] = index
+        return index
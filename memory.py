@@ -0,0 +1,72 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from chunking import count_tokens
+from rag import summarize_text
+
+RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "4"))  # question/answer pairs kept verbatim
+MEMORY_TOKENS = int(os.getenv("MEMORY_TOKENS", "1500"))  # verbatim turns sent with a question
+SUMMARY_TOKENS = 300  # length of the rolling summary
+SPEAKERS = {"user": "Citoyen", "assistant": "Assistant"}
+
+# Shared by every session: summaries are written off the Streamlit thread
+_summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+
+
+class ConversationMemory:
+    """What the model remembers of a chat: the last turns verbatim, older ones as a summary.
+
+    Turns pushed out of the verbatim window are folded into the summary in the background,
+    so memory and prompt size stay bounded however long the conversation.
+    """
+
+    def __init__(self, recent_turns=RECENT_TURNS):
+        self.max_messages = recent_turns * 2
+        self.summary = ""
+        self.recent = []
+        self._pending = []  # messages out of the window, not yet in the summary
+        self._summarizing = False
+        self._lock = threading.Lock()
+
+    def add(self, role, content):
+        with self._lock:
+            self.recent.append({"role": role, "content": content})
+            overflow = len(self.recent) - self.max_messages
+            if overflow <= 0:
+                return
+            self._pending.extend(self.recent[:overflow])
+            del self.recent[:overflow]
+            if self._summarizing:
+                return  # the running summary picks these up when it finishes
+            self._summarizing = True
+        _summary_pool.submit(self._summarize)
+
+    def _summarize(self):
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                summary = self.summary
+                if not pending:
+                    self._summarizing = False
+                    return
+            transcript = "\n".join(f"{SPEAKERS.get(m['role'], m['role'])} : {m['content']}" for m in pending)
+            text = f"Résumé de la conversation jusqu'ici :\n{summary}\n\nSuite de la conversation :\n{transcript}" if summary else transcript
+            result = summarize_text(text, max_length=SUMMARY_TOKENS)
+            with self._lock:
+                if result.startswith("Summary error:"):
+                    # Keep the previous summary; the dropped turns are lost rather than retried forever
+                    continue
+                self.summary = result
+
+    def prompt_messages(self, model="gpt-4o"):
+        """Summary and the most recent turns that fit in MEMORY_TOKENS, oldest first."""
+        with self._lock:
+            summary, recent = self.summary, list(self.recent)
+        messages, used = [], 0
+        for message in reversed(recent):
+            used += count_tokens(message["content"], model)
+            if used > MEMORY_TOKENS:
+                break
+            messages.append(message)
+        return summary, messages[::-1]
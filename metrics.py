@@ -0,0 +1,201 @@
+"""Latency, token, cache and error metrics for the chat pipeline.
+
+Wrap external calls in ``trace(stage)``; numbers are exported in the Prometheus text
+format to METRICS_PATH (and on http://localhost:METRICS_PORT/metrics when set)::
+
+    with trace("openai.chat") as span:
+        response = client.chat.completions.create(...)
+        span.usage = response.usage
+"""
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+METRICS_PATH = os.getenv("METRICS_PATH", "cache/metrics.prom")
+METRICS_PORT = os.getenv("METRICS_PORT")  # unset: no HTTP endpoint
+METRICS_EXPORT_INTERVAL = 15  # seconds between two writes of METRICS_PATH
+WINDOW = 2048  # latest durations kept per stage for the percentiles
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list."""
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Span:
+    """What a traced block may report besides its duration."""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.usage = None  # OpenAI ``response.usage``, counted when the block ends
+
+
+class Metrics:
+    """Durations (rolling window per stage) and counters shared by every session."""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.durations = {}  # stage -> deque of seconds
+        self.totals = {}  # stage -> [count, sum of seconds] since start
+        self.counters = {}  # (name, sorted label items) -> value
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.durations.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+            total = self.totals.setdefault(stage, [0, 0.0])
+            total[0] += 1
+            total[1] += seconds
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def summary(self):
+        """One row per stage: count and p50/p95/p99 in milliseconds, plus error count."""
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self.durations.items()}
+            totals = {stage: list(total) for stage, total in self.totals.items()}
+            errors = {}
+            for (name, labels), value in self.counters.items():
+                if name == "errors_total":
+                    stage = dict(labels)["stage"]
+                    errors[stage] = errors.get(stage, 0) + value
+        rows = []
+        for stage, ordered in sorted(durations.items()):
+            row = {"stage": stage, "count": totals[stage][0], "errors": errors.get(stage, 0)}
+            for q in QUANTILES:
+                row[f"p{int(q * 100)} (ms)"] = round(_percentile(ordered, q) * 1000, 1)
+            rows.append(row)
+        return rows
+
+    def counter_rows(self):
+        with self._lock:
+            return [
+                {"metric": name, "labels": ", ".join(f"{k}={v}" for k, v in labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+
+    def render(self):
+        """Prometheus text exposition of every metric."""
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self.durations.items()}
+            totals = {stage: list(total) for stage, total in self.totals.items()}
+            counters = sorted(self.counters.items())
+
+        lines = [
+            "# HELP voxpopuli_stage_seconds Duration of each pipeline stage.",
+            "# TYPE voxpopuli_stage_seconds summary",
+        ]
+        for stage, ordered in sorted(durations.items()):
+            for q in QUANTILES:
+                lines.append(f'voxpopuli_stage_seconds{{stage="{stage}",quantile="{q}"}} {_percentile(ordered, q):.6f}')
+            lines.append(f'voxpopuli_stage_seconds_count{{stage="{stage}"}} {totals[stage][0]}')
+            lines.append(f'voxpopuli_stage_seconds_sum{{stage="{stage}"}} {totals[stage][1]:.6f}')
+
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                lines.append(f"# TYPE voxpopuli_{name} counter")
+                declared.add(name)
+            label_text = ",".join(f'{key}="{value_}"' for key, value_ in labels)
+            lines.append(f"voxpopuli_{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path=METRICS_PATH):
+        """Atomically write the exposition to a file (for node_exporter's textfile collector)."""
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(path + ".tmp", path)
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """Return the process-wide metrics."""
+    return _metrics
+
+
+@contextmanager
+def trace(stage):
+    """Time a block; errors are counted by type and re-raised, token usage is recorded."""
+    span = Span(stage)
+    started = time.perf_counter()
+    try:
+        yield span
+    except Exception as e:
+        record_error(stage, e)
+        raise
+    finally:
+        _metrics.observe(stage, time.perf_counter() - started)
+        if span.usage is not None:
+            record_usage(stage, span.usage)
+
+
+def record_error(stage, error):
+    """Count an error by stage and exception type (for errors that are turned into strings)."""
+    _metrics.increment("errors_total", stage=stage, type=type(error).__name__)
+
+
+def record_usage(stage, usage):
+    """Count the prompt and completion tokens of an OpenAI response."""
+    for kind in ("prompt_tokens", "completion_tokens"):
+        tokens = getattr(usage, kind, None)
+        if tokens:
+            _metrics.increment("tokens_total", tokens, stage=stage, kind=kind.split("_")[0])
+
+
+def record_cache(cache, hit):
+    """Count a cache lookup."""
+    _metrics.increment("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = _metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_exporter_started = False
+_exporter_lock = threading.Lock()
+
+
+def _export_forever(path):
+    while True:
+        time.sleep(METRICS_EXPORT_INTERVAL)
+        try:
+            _metrics.write(path)
+        except OSError:
+            pass
+
+
+def start_exporter(path=METRICS_PATH, port=METRICS_PORT):
+    """Start writing the metrics file (and serving /metrics if a port is set), once per process."""
+    global _exporter_started
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+    threading.Thread(target=_export_forever, args=(path,), name="metrics-file", daemon=True).start()
+    if port:
+        server = ThreadingHTTPServer(("127.0.0.1", int(port)), _Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
@@ -0,0 +1,116 @@
+"""Background sentiment and toxicity scoring of comments.
+
+New comments are drained in batches and every batch is scored by a single chat completion
+returning JSON, so cost and latency grow with the number of batches rather than comments.
+"""
+import os
+import json
+import time
+import threading
+
+from clients import get_openai_client
+from metrics import trace, get_metrics, record_error
+from scheduler import llm_slot, with_backoff, estimate_tokens
+
+MODERATION_MODEL = os.getenv("MODERATION_MODEL", "gpt-4o-mini")
+MODERATION_BATCH_SIZE = int(os.getenv("MODERATION_BATCH_SIZE", "20"))
+MODERATION_INTERVAL = float(os.getenv("MODERATION_INTERVAL", "30"))  # seconds between checks when idle
+MODERATION_DELAY = 2.0  # seconds to let more comments arrive after a nudge, so they share a batch
+TOXICITY_THRESHOLD = float(os.getenv("TOXICITY_THRESHOLD", "0.7"))  # comments at or above are hidden
+COMMENT_CHARS = 1000  # longer comments are truncated for scoring
+
+INSTRUCTIONS = (
+    "You moderate comments posted by citizens on a municipal participation platform. "
+    "For each comment, rate its sentiment from -1 (very negative) to 1 (very positive) and its "
+    "toxicity from 0 (civil) to 1 (insulting, hateful, threatening or harassing). Criticism of a "
+    "project is not toxic. Reply with JSON only: "
+    '{"scores": [{"id": <comment id>, "sentiment": <number>, "toxicity": <number>}]}'
+)
+
+
+def _clamp(value, low, high):
+    try:
+        return min(high, max(low, float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+def score_comments(comments, model=MODERATION_MODEL):
+    """Score (id, body) pairs in one call; returns {str(id): (sentiment, toxicity)} for the ids answered."""
+    listing = "\n".join(f"[{comment_id}] {body[:COMMENT_CHARS]}" for comment_id, body in comments)
+    messages = [
+        {"role": "system", "content": INSTRUCTIONS},
+        {"role": "user", "content": listing},
+    ]
+    max_tokens = 30 * len(comments) + 20
+    with llm_slot(model, estimate_tokens(messages, max_tokens=max_tokens, model=model)) as ticket, trace("openai.moderation") as span:
+        response = with_backoff(lambda: get_openai_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=0,
+            response_format={"type": "json_object"},
+        ), model)
+        span.usage = ticket.usage = response.usage
+    scores = {}
+    for item in json.loads(response.choices[0].message.content).get("scores", []):
+        if isinstance(item, dict) and "id" in item:
+            scores[str(item["id"]).strip("[] ")] = (_clamp(item.get("sentiment"), -1.0, 1.0), _clamp(item.get("toxicity"), 0.0, 1.0))
+    return scores
+
+
+class ModerationWorker:
+    """Thread scoring unscored comments of the store, batch after batch, until none are left."""
+
+    def __init__(self, storage, batch_size=MODERATION_BATCH_SIZE, interval=MODERATION_INTERVAL):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.interval = interval
+        self._wake = threading.Event()
+
+    def nudge(self):
+        """Check for new comments now instead of at the next interval."""
+        self._wake.set()
+
+    def drain(self):
+        """Score every unscored comment; returns the number scored."""
+        scored = 0
+        while True:
+            self.storage.flush()  # comments just posted, and the scores of the previous batch
+            batch = self.storage.unscored_comments(self.batch_size)
+            if not batch:
+                return scored
+            scores = score_comments([(comment_id, body) for comment_id, _, body in batch])
+            # Comments missing from the reply are stored unscored, so one bad comment can't stall the queue
+            self.storage.add_comment_scores(
+                (comment_id, announcement_id) + scores.get(str(comment_id), (None, None))
+                for comment_id, announcement_id, _ in batch
+            )
+            get_metrics().increment("comments_scored_total", len(batch))
+            scored += len(batch)
+
+    def run(self):
+        while True:
+            try:
+                self.drain()
+            except Exception as e:
+                # API or JSON failure: the batch stays unscored and is retried at the next check
+                record_error("moderation", e)
+            self._wake.wait(self.interval)
+            if self._wake.is_set():
+                time.sleep(MODERATION_DELAY)
+                self._wake.clear()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_moderation(storage):
+    """Start the moderation worker of this process, once; returns it."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = ModerationWorker(storage)
+            threading.Thread(target=_worker.run, name="comment-moderation", daemon=True).start()
+        return _worker
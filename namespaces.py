@@ -0,0 +1,43 @@
+import os
+import re
+import unicodedata
+
+# Themes offered across the app; each has its own vector namespace (shard)
+THEMES = ["Pollution environnementale", "Social", "Économie", "Transport", "Culture"]
+ALL_THEMES = "Tous les thèmes"
+# Documents not tied to a theme (and everything ingested before themes existed)
+SHARED_NAMESPACE = "ns1"
+# Municipality this deployment serves; documents tagged ALL_MUNICIPALITIES apply everywhere
+MUNICIPALITY = os.getenv("VOXPOPULI_MUNICIPALITY") or None
+ALL_MUNICIPALITIES = "*"
+
+
+def namespace_for(theme):
+    """Namespace of a theme ("Économie" -> "theme-economie"); the shared one for no theme."""
+    if not theme or theme == ALL_THEMES:
+        return SHARED_NAMESPACE
+    text = unicodedata.normalize("NFKD", theme)
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    return "theme-" + re.sub(r"[^a-z0-9]+", "-", text).strip("-")
+
+
+def namespaces_for(theme):
+    """Namespaces a question on this theme is sent to: its shard and the shared one, or all of them."""
+    if not theme or theme == ALL_THEMES:
+        return [namespace_for(name) for name in THEMES] + [SHARED_NAMESPACE]
+    return [namespace_for(theme), SHARED_NAMESPACE]
+
+
+def document_metadata(theme=None, municipality=None):
+    """Metadata fields every chunk of a document carries, used for filtering."""
+    metadata = {"municipality": municipality or ALL_MUNICIPALITIES}
+    if theme and theme != ALL_THEMES:
+        metadata["theme"] = theme
+    return metadata
+
+
+def metadata_filter(municipality=MUNICIPALITY):
+    """Vector index filter keeping one municipality's documents and the general ones (None: no filter)."""
+    if not municipality:
+        return None
+    return {"municipality": {"$in": [municipality, ALL_MUNICIPALITIES]}}
@@ -0,0 +1,252 @@
+import os
+import base64
+from dotenv import load_dotenv, find_dotenv
+
+from clients import get_openai_client, get_pinecone_index, reconnect_pinecone_index
+from answer_cache import mark_index_changed
+from chunking import CHUNK_TOKENS, CHUNK_OVERLAP, iter_chunks
+from context import is_reasoning_model
+from namespaces import SHARED_NAMESPACE
+from embedding_cache import get_embedding_cache
+from local_index import get_local_index
+from lazy_imports import lazy_import
+from metrics import trace, record_error
+from scheduler import MAX_RETRIES, llm_slot, with_backoff, estimate_tokens
+
+github = lazy_import("github")
+
+# "pinecone" (default) or "local" for the in-process index under LOCAL_INDEX_DIR
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "index")
+EMBEDDING_BATCH_SIZE = 128  # inputs per embeddings.create call
+HYBRID_CANDIDATES = 10  # matches taken from each retriever before fusion
+
+
+def load_environment_variables(env_paths):
+    """Load environment variables from specified paths."""
+    for folder, filename in env_paths:
+        dotenv_path = find_dotenv(os.path.join(folder, filename), raise_error_if_not_found=True, usecwd=True)
+        load_dotenv(dotenv_path, override=True)
+
+def generate_openai_response(system_prompt, user_prompt, model_params, env_variables):
+    """Generate a response from the OpenAI model."""
+    client = get_openai_client(env_variables["openai_api_key"])
+    model = model_params['selected_model']
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+    try:
+        with llm_slot(model, estimate_tokens(messages, max_tokens=model_params['max_length'])) as ticket, trace("openai.chat") as span:
+            response = with_backoff(lambda: client.chat.completions.create(
+                model=model,
+                max_tokens=model_params['max_length'],
+                temperature=model_params['temperature'],
+                top_p=model_params['top_p'],
+                frequency_penalty=model_params['frequency_penalty'],
+                messages=messages
+            ), model)
+            span.usage = ticket.usage = response.usage
+        return response.choices[0].message.content if response.choices else "No response found."
+    except Exception as e:
+        return f"An error occurred: {str(e)}"
+
+def _embedding_client(timeout=None):
+    client = get_openai_client()
+    return client if timeout is None else client.with_options(timeout=timeout)
+
+def get_embedding(text, model="text-embedding-3-small", retries=MAX_RETRIES, timeout=None):
+    """Get text embedding, served from the embedding cache when possible.
+
+    Interactive lookups that can do without the result pass a short timeout and no retries.
+    """
+    cache = get_embedding_cache()
+    cached = cache.get(model, text)
+    if cached is not None:
+        return cached
+
+    with llm_slot(model, estimate_tokens(texts=[text])) as ticket, trace("openai.embedding") as span:
+        response = with_backoff(lambda: _embedding_client(timeout).embeddings.create(
+            model=model,
+            input=text,
+            encoding_format="float"
+        ), model, retries)
+        span.usage = ticket.usage = response.usage
+    embedding = response.data[0].embedding
+    cache.put(model, text, embedding)
+    return embedding
+
+def get_embeddings(texts, model="text-embedding-3-small", batch_size=EMBEDDING_BATCH_SIZE, retries=MAX_RETRIES, timeout=None):
+    """Embed many texts, sending only cache misses and batching them per request."""
+    cache = get_embedding_cache()
+    embeddings = [cache.get(model, text) for text in texts]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        inputs = [texts[i] for i in batch]
+        with llm_slot(model, estimate_tokens(texts=inputs)) as ticket, trace("openai.embedding_batch") as span:
+            response = with_backoff(lambda: _embedding_client(timeout).embeddings.create(
+                model=model,
+                input=inputs,
+                encoding_format="float"
+            ), model, retries)
+            span.usage = ticket.usage = response.usage
+        for i, item in zip(batch, sorted(response.data, key=lambda item: item.index)):
+            embeddings[i] = item.embedding
+            cache.put(model, texts[i], item.embedding)
+
+    return embeddings
+
+def summarize_text(text, model="gpt-4o", max_length=512):
+    """Summarize the given text."""
+    messages = [{"role": "user", "content": f"Summarize the following text:\n\n{text}"}]
+    try:
+        with llm_slot(model, estimate_tokens(messages, max_tokens=max_length)) as ticket, trace("openai.summary") as span:
+            response = with_backoff(lambda: get_openai_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_length,
+                temperature=0.7
+            ), model)
+            span.usage = ticket.usage = response.usage
+        return response.choices[0].message.content
+    except Exception as e:
+        return f"Summary error: {str(e)}"
+
+def _refine_messages(text, prompt, model="gpt-4o", history=None):
+    """Build the chat messages used to refine an answer.
+
+    history is the (summary, recent messages) pair of a ConversationMemory, for follow-ups.
+    """
+    system = "Tu adoptes le ton d'un assistant amical. Ton rôle est de parler de la participation citoyenne à l'aide des conaissances fournies"
+    user = f"Affine et fait un sommaire des informations pertinentes afin de répondre à cette question : {prompt}\n\n{text}"
+    summary, turns = history or ("", [])
+    if summary:
+        system += f"\n\nRésumé du début de la conversation : {summary}"
+    history_messages = [{"role": m["role"], "content": m["content"]} for m in turns]
+    if is_reasoning_model(model):
+        # No system role for o1 models: the instructions lead the question
+        return history_messages + [{"role": "user", "content": f"{system}\n\n{user}"}]
+    return [{"role": "system", "content": system}] + history_messages + [{"role": "user", "content": user}]
+
+def _refine_request(text, prompt, model, max_length, history=None):
+    """Arguments of the chat completion call that refines an answer."""
+    request = {"model": model, "messages": _refine_messages(text, prompt, model, history), "temperature": 1}
+    request["max_completion_tokens" if is_reasoning_model(model) else "max_tokens"] = max_length
+    return request
+
+def refine_response(text, prompt, model="gpt-4o", max_length=1024, history=None):
+    """Refine the response based on the prompt."""
+    request = _refine_request(text, prompt, model, max_length, history)
+    try:
+        with llm_slot(model, estimate_tokens(request["messages"], max_tokens=max_length)) as ticket, trace("openai.generation") as span:
+            response = with_backoff(lambda: get_openai_client().chat.completions.create(**request), model)
+            span.usage = ticket.usage = response.usage
+        return response.choices[0].message.content
+    except Exception as e:
+        return f"Refinement error: {str(e)}"
+
+def extract_text_from_pdf(file_content):
+    """Extract text from a PDF file."""
+    from pdf2image import convert_from_bytes
+    import pytesseract
+
+    images = convert_from_bytes(file_content, poppler_path=os.getenv("POPPLER_PATH"))
+    if os.getenv("TESSERACT_CMD"):
+        pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_CMD")
+    text = "".join(pytesseract.image_to_string(image) for image in images)
+    return text
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP, boundary="sentence"):
+    """Chunk text into pieces of at most max_tokens real tokens (see chunking.iter_chunks)."""
+    return list(iter_chunks(text, max_tokens=max_tokens, overlap=overlap, boundary=boundary))
+
+def retrieve_github_documents(github_token, repo_name, branch='documents', path=None):
+    """Retrieve documents from a GitHub repository."""
+    g = github.Github(github_token)
+    repo = g.get_repo(repo_name)
+    contents = repo.get_contents(path or "", ref=branch)
+    documents = []
+
+    while contents:
+        file_content = contents.pop(0)
+        if file_content.type == 'file' and file_content.path.endswith('.pdf'):
+            content_file = repo.get_contents(file_content.path, ref=branch)
+            file_content_data = base64.b64decode(content_file.content)
+            documents.append({"file_path": file_content.path, "file_content": file_content_data})
+        elif file_content.type == 'dir':
+            contents.extend(repo.get_contents(file_content.path, ref=branch))
+
+    return documents
+
+def initialize_pinecone(api_key, index_name):
+    """Return the shared vector index (built once per process, see clients.py).
+
+    With VECTOR_BACKEND=local this is a LocalIndex exposing the same
+    upsert/query/describe_index_stats calls, so the rest of the pipeline is unchanged.
+    """
+    if VECTOR_BACKEND == "local":
+        return get_local_index(LOCAL_INDEX_DIR)
+    return get_pinecone_index(api_key, index_name)
+
+def is_pinecone_index_empty(index, namespace=None):
+    """Check if a Pinecone index (or one of its namespaces) is empty."""
+    response = index.describe_index_stats()
+    if namespace is None:
+        return response['total_vector_count'] == 0
+    return response['namespaces'].get(namespace, {}).get('vector_count', 0) == 0
+
+def store_vectors_in_pinecone(index, vectors, namespace=SHARED_NAMESPACE):
+    """Store vectors in the Pinecone index."""
+    with trace("vector.upsert"):
+        index.upsert(vectors=vectors, namespace=namespace)
+    # Cached answers may be stale once the corpus changes, here and in the app's process
+    mark_index_changed()
+
+def delete_vectors_from_pinecone(index, ids, namespace=SHARED_NAMESPACE):
+    """Delete vectors from the Pinecone index."""
+    if ids:
+        index.delete(ids=ids, namespace=namespace)
+        mark_index_changed()
+
+def query_pinecone_index(index, query_vector, top_k=3, namespace=SHARED_NAMESPACE, filter=None):
+    """Query the Pinecone index, reconnecting once if the handle went stale."""
+    def run_query(target):
+        request = {
+            "namespace": namespace,
+            "vector": query_vector,
+            "top_k": top_k,
+            "include_values": False,
+            "include_metadata": True
+        }
+        if filter:
+            request["filter"] = filter
+        return target.query(**request)
+
+    with trace("vector.query"):
+        try:
+            response = run_query(index)
+        except Exception as e:
+            record_error("vector.query", e)
+            fresh_index = reconnect_pinecone_index(index)
+            if fresh_index is None:
+                raise
+            response = run_query(fresh_index)
+    return response['matches']
+
+def merge_top_k(match_lists, top_k):
+    """Overall top-k of per-namespace matches.
+
+    Scores come from the same index and metric, so they compare across namespaces.
+    """
+    matches = [match for matches in match_lists for match in matches]
+    return sorted(matches, key=lambda match: match['score'], reverse=True)[:top_k]
+
+def bm25_filter(namespaces, municipality_filter=None):
+    """BM25 corpus filter matching the vector namespaces (and municipality) searched."""
+    allowed = list(namespaces)
+    if SHARED_NAMESPACE in allowed:
+        allowed.append(None)  # corpus records written before namespaces existed are shared
+    return dict(municipality_filter or {}, namespace={"$in": allowed})
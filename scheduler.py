@@ -0,0 +1,360 @@
+"""Process-wide scheduling of OpenAI calls.
+
+Every call takes a slot first: slots are handed out round-robin across sessions, within
+a concurrency limit and the requests/min and tokens/min quota of the model, so a burst
+of visitors queues up instead of turning into 429 errors::
+
+    with llm_slot("gpt-4o", estimated_tokens, on_wait=show_position) as ticket:
+        response = with_backoff(lambda: client.chat.completions.create(...), "gpt-4o")
+        ticket.usage = response.usage
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+
+from chunking import count_tokens
+from metrics import get_metrics
+
+# (requests per minute, tokens per minute); override with OPENAI_QUOTAS='{"gpt-4o": [500, 30000]}'
+MODEL_QUOTAS = {
+    "gpt-4o": (500, 30000),
+    "gpt-4o-mini": (500, 200000),
+    "o1-mini": (500, 200000),
+    "gpt-3.5-turbo": (3500, 200000),
+    "text-embedding-3-small": (3000, 1000000),
+}
+MODEL_QUOTAS.update({model: tuple(quota) for model, quota in json.loads(os.getenv("OPENAI_QUOTAS", "{}")).items()})
+DEFAULT_QUOTA = (500, 30000)
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+BASE_BACKOFF = 0.5  # seconds before the first retry, doubled on each attempt
+MAX_BACKOFF = 20.0
+POSITION_REFRESH = 0.5  # seconds between two queue position updates
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# OpenAI's transient errors, then Pinecone's and the urllib3 ones its client lets through
+RETRYABLE_ERRORS = {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError",
+                    "ServiceException", "PineconeProtocolError", "MaxRetryError", "ProtocolError"}
+
+# Session the current call is made for, and the slots (model -> ticket) this context already holds
+_session = contextvars.ContextVar("llm_session", default="background")
+_held = contextvars.ContextVar("llm_held", default={})
+
+
+def set_session(session_id):
+    """Attribute the calls of the current thread (a Streamlit rerun) to a session."""
+    _session.set(session_id)
+
+
+def current_context():
+    """Session and held slots, to carry over to another thread or event loop task."""
+    return _session.get(), _held.get()
+
+
+def restore_context(context):
+    session, held = context
+    _session.set(session)
+    _held.set(held)
+
+
+class TokenBucket:
+    """Allowance refilled continuously at `per_minute`, bursting up to one minute's worth."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount):
+        """Seconds until `amount` is available (requests larger than the bucket wait for a full one)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+    def drain(self):
+        self._refill()
+        self.level = min(self.level, 0.0)
+
+
+class Ticket:
+    """A queued or granted call. Set ``usage`` to the response usage to settle the token estimate."""
+
+    def __init__(self, session, model, tokens):
+        self.session = session
+        self.model = model
+        self.tokens = tokens
+        self.usage = None
+        self.queued_at = time.monotonic()
+        self.granted = False
+        self.future = None  # set for coroutines waiting on an event loop
+
+
+class LLMScheduler:
+    """Fair queue in front of the OpenAI quotas, shared by every session of the process."""
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, quotas=MODEL_QUOTAS):
+        self.max_concurrency = max_concurrency
+        self.quotas = quotas
+        self.active = 0
+        self._queues = OrderedDict()  # session -> deque of tickets, in round-robin order
+        self._buckets = {}  # model -> (requests bucket, tokens bucket)
+        self._changed = threading.Condition()
+
+    def _model_buckets(self, model):
+        if model not in self._buckets:
+            requests, tokens = self.quotas.get(model, DEFAULT_QUOTA)
+            self._buckets[model] = (TokenBucket(requests), TokenBucket(tokens))
+        return self._buckets[model]
+
+    def _delay(self, ticket):
+        requests, tokens = self._model_buckets(ticket.model)
+        return max(requests.delay(1), tokens.delay(ticket.tokens))
+
+    def _next(self):
+        """First queue head, in round-robin order, whose model quota allows it now; and the
+        shortest wait for a quota otherwise."""
+        shortest = None
+        for queue in self._queues.values():
+            delay = self._delay(queue[0])
+            if delay == 0:
+                return queue[0], 0.0
+            shortest = delay if shortest is None else min(shortest, delay)
+        return None, shortest
+
+    def position(self, ticket):
+        """1-based place of a ticket in the round-robin order (each session serves one per round)."""
+        sessions = list(self._queues)
+        depth = self._queues[ticket.session].index(ticket)
+        own = sessions.index(ticket.session)
+        ahead = sum(min(len(self._queues[session]), depth) for session in sessions)
+        ahead += sum(1 for session in sessions[:own] if len(self._queues[session]) > depth)
+        return ahead + 1
+
+    def _remove(self, ticket):
+        queue = self._queues.get(ticket.session)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.session]
+        self._changed.notify_all()
+
+    def _grant(self, ticket):
+        self._remove(ticket)
+        if ticket.session in self._queues:
+            self._queues.move_to_end(ticket.session)  # its next call waits for the other sessions
+        requests, tokens = self._model_buckets(ticket.model)
+        requests.take(1)
+        tokens.take(ticket.tokens)
+        self.active += 1
+        ticket.granted = True
+        if ticket.future is not None:
+            ticket.future.get_loop().call_soon_threadsafe(_resolve, ticket.future, ticket)
+
+    def _dispatch(self):
+        """Grant slots to queue heads while concurrency and quotas allow; returns the shortest
+        wait for a quota, or None."""
+        while self.active < self.max_concurrency:
+            ticket, delay = self._next()
+            if ticket is None:
+                return delay
+            self._grant(ticket)
+        return None
+
+    def _enqueue(self, ticket):
+        with self._changed:
+            self._queues.setdefault(ticket.session, deque()).append(ticket)
+            return self._dispatch()
+
+    def _abandon(self, ticket):
+        """A waiter gave up (e.g. Streamlit stopped the script): leave the queue, or hand back the slot."""
+        with self._changed:
+            if ticket.granted:
+                self._release(ticket)
+            else:
+                self._remove(ticket)
+                self._dispatch()
+
+    def acquire(self, model, tokens, session=None, on_wait=None):
+        """Block until the call may start; on_wait(position) is called while queued."""
+        ticket = Ticket(session or _session.get(), model, tokens)
+        delay = self._enqueue(ticket)
+        try:
+            while True:
+                with self._changed:
+                    if ticket.granted:
+                        break
+                    position = self.position(ticket)
+                # Outside the lock: the callback renders UI and must not hold up other sessions
+                if on_wait:
+                    on_wait(position)
+                with self._changed:
+                    if not ticket.granted:
+                        self._changed.wait(min(delay, POSITION_REFRESH) if delay else POSITION_REFRESH)
+                        delay = self._dispatch()  # a quota may have refilled meanwhile
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        get_metrics().observe("llm.queue_wait", time.monotonic() - ticket.queued_at)
+        return ticket
+
+    async def acquire_async(self, model, tokens, session=None):
+        """acquire for coroutines: waits on a future resolved by the granting thread, so no
+        executor thread is held while queued."""
+        ticket = Ticket(session or _session.get(), model, tokens)
+        ticket.future = asyncio.get_running_loop().create_future()
+        delay = self._enqueue(ticket)
+        try:
+            while not ticket.future.done():
+                try:
+                    await asyncio.wait_for(asyncio.shield(ticket.future), min(delay, POSITION_REFRESH) if delay else POSITION_REFRESH)
+                except asyncio.TimeoutError:
+                    with self._changed:
+                        delay = self._dispatch()  # a quota may have refilled meanwhile
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        get_metrics().observe("llm.queue_wait", time.monotonic() - ticket.queued_at)
+        return ticket
+
+    def _release(self, ticket):
+        self.active -= 1
+        used = getattr(ticket.usage, "total_tokens", None)
+        if used is not None and used < ticket.tokens:
+            self._model_buckets(ticket.model)[1].give_back(ticket.tokens - used)
+        self._dispatch()
+        self._changed.notify_all()
+
+    def release(self, ticket):
+        with self._changed:
+            self._release(ticket)
+
+    def rate_limited(self, model):
+        """The API said 429: stop handing out slots for this model until its buckets refill."""
+        with self._changed:
+            # Only models that take slots have buckets (not e.g. the vector index)
+            for bucket in self._buckets.get(model, ()):
+                bucket.drain()
+        get_metrics().increment("rate_limited_total", model=model)
+
+    def queued(self):
+        with self._changed:
+            return sum(len(queue) for queue in self._queues.values())
+
+
+def _resolve(future, ticket):
+    if not future.done():
+        future.set_result(ticket)
+
+
+_scheduler = LLMScheduler()
+
+
+def get_scheduler():
+    """Return the process-wide scheduler."""
+    return _scheduler
+
+
+@contextmanager
+def llm_slot(model, tokens, on_wait=None):
+    """Hold a slot for one call (or a whole stream). Nested slots for the same model share it."""
+    if model in _held.get():
+        # Usage reported on the inner call settles the outer slot's estimate
+        yield _held.get()[model]
+        return
+    ticket = _scheduler.acquire(model, tokens, on_wait=on_wait)
+    held = _held.get()
+    _held.set({**held, model: ticket})
+    try:
+        yield ticket
+    finally:
+        # Not a token reset: a streaming generator may be closed from another context
+        _held.set(held)
+        _scheduler.release(ticket)
+
+
+@asynccontextmanager
+async def allm_slot(model, tokens):
+    """llm_slot for coroutines: queued on the event loop itself, without blocking a thread."""
+    if model in _held.get():
+        # Usage reported on the inner call settles the outer slot's estimate
+        yield _held.get()[model]
+        return
+    ticket = await _scheduler.acquire_async(model, tokens)
+    held = _held.get()
+    _held.set({**held, model: ticket})
+    try:
+        yield ticket
+    finally:
+        _held.set(held)
+        _scheduler.release(ticket)
+
+
+def _retry_delay(error, attempt):
+    """Seconds to wait before retrying, or None if the error is not worth retrying."""
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)  # OpenAI, Pinecone
+    if type(error).__name__ not in RETRYABLE_ERRORS and status not in RETRYABLE_STATUS:
+        return None
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def with_backoff(call, model, retries=MAX_RETRIES):
+    """Run call(), retrying rate limits and transient errors with jittered exponential backoff.
+
+    model labels the retry metrics; for an OpenAI model, a 429 also pauses its slots.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return call()
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt == retries:
+                raise
+            if getattr(e, "status_code", None) == 429:
+                _scheduler.rate_limited(model)
+            get_metrics().increment("retries_total", model=model, type=type(e).__name__)
+            time.sleep(delay)
+
+
+async def awith_backoff(call, model, retries=MAX_RETRIES):
+    """with_backoff for a coroutine factory."""
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt == retries:
+                raise
+            if getattr(e, "status_code", None) == 429:
+                _scheduler.rate_limited(model)
+            get_metrics().increment("retries_total", model=model, type=type(e).__name__)
+            await asyncio.sleep(delay)
+
+
+def estimate_tokens(messages=None, texts=(), max_tokens=0, model="gpt-4o"):
+    """Tokens a call will count against the quota: its input plus the completion cap."""
+    parts = [message["content"] for message in messages or []] + list(texts)
+    return sum(count_tokens(part, model) + 4 for part in parts) + max_tokens
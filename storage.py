@@ -0,0 +1,358 @@
+import os
+import time
+import sqlite3
+import threading
+
+from metrics import record_error
+
+DB_PATH = os.getenv("VOXPOPULI_DB_PATH", "data/voxpopuli.sqlite3")
+WRITE_BATCH_SIZE = 64  # pending writes that trigger an immediate flush
+WRITE_FLUSH_INTERVAL = 0.05  # seconds a write may wait to be batched with others
+WRITE_RETRY_DELAY = 1.0  # seconds before retrying a batch the database refused (e.g. locked)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS announcements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    date TEXT NOT NULL,
+    description TEXT NOT NULL,
+    image TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    announcement_id INTEGER NOT NULL REFERENCES announcements (id),
+    body TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comments_by_announcement ON comments (announcement_id, id);
+CREATE TABLE IF NOT EXISTS comment_scores (
+    comment_id INTEGER PRIMARY KEY REFERENCES comments (id),
+    announcement_id INTEGER NOT NULL REFERENCES announcements (id),
+    sentiment REAL,
+    toxicity REAL,
+    scored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comment_scores_by_announcement ON comment_scores (announcement_id, toxicity);
+CREATE TABLE IF NOT EXISTS proposals (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    announcement_id INTEGER NOT NULL REFERENCES announcements (id),
+    last_comment_id INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS proposals_by_announcement ON proposals (announcement_id);
+CREATE TABLE IF NOT EXISTS chat_messages (
+    conversation_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (conversation_id, seq)
+);
+"""
+
+DEFAULT_ANNOUNCEMENTS = [
+    {
+        "title": "Projet environnemental Rue de la Paix",
+        "date": "10 février",
+        "desc": "Une initiative pour réduire les déchets et promouvoir la biodiversité urbaine.",
+        "image": "images/environment.jpg",
+    },
+    {
+        "title": "Aménagement cyclable Avenue des Fleurs",
+        "date": "15 février",
+        "desc": "Proposition de nouvelles pistes cyclables pour une mobilité durable.",
+        "image": "images/cycling.jpg",
+    },
+    {
+        "title": "Réhabilitation de l'École Jean Moulin",
+        "date": "20 février",
+        "desc": "Travaux pour moderniser l'école et améliorer son efficacité énergétique.",
+        "image": "images/school.jpg",
+    },
+]
+
+
+class Storage:
+    """SQLite store shared by every session, with batched writes and a read-through cache."""
+
+    def __init__(self, path=DB_PATH):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db_lock = threading.Lock()
+
+        self._cache = {}
+        self._generation = 0
+        self._cache_lock = threading.Lock()
+        self._pending = []
+        self._pending_changed = threading.Condition()
+        self._flush_lock = threading.Lock()  # keeps batches committed in submission order
+
+        if self._query("SELECT COUNT(*) AS n FROM announcements")[0]["n"] == 0:
+            for announcement in DEFAULT_ANNOUNCEMENTS:
+                self.add_announcement(announcement["title"], announcement["desc"], announcement["image"], announcement["date"])
+            self.flush()
+
+        threading.Thread(target=self._writer, name="storage-writer", daemon=True).start()
+
+    # Writes
+
+    def _enqueue(self, sql, params):
+        with self._pending_changed:
+            self._pending.append((sql, params))
+            self._pending_changed.notify()
+
+    def _writer(self):
+        """Background thread grouping writes from all sessions into one transaction."""
+        while True:
+            with self._pending_changed:
+                while not self._pending:
+                    self._pending_changed.wait()
+                # Give other sessions a moment to add to the same batch
+                deadline = time.monotonic() + WRITE_FLUSH_INTERVAL
+                while len(self._pending) < WRITE_BATCH_SIZE and time.monotonic() < deadline:
+                    self._pending_changed.wait(deadline - time.monotonic())
+            try:
+                self.flush()
+            except Exception as e:
+                # The batch is back in the queue: keep the writer alive and try again shortly
+                record_error("storage.flush", e)
+                time.sleep(WRITE_RETRY_DELAY)
+
+    def flush(self):
+        """Write every pending statement in a single transaction and invalidate the cache."""
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._pending_changed:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            self._commit(pending)
+        except sqlite3.OperationalError:
+            # e.g. "database is locked" by another replica: nothing was written, keep the
+            # statements at the head of the queue for the next flush
+            with self._pending_changed:
+                self._pending[:0] = pending
+            raise
+        except sqlite3.DatabaseError:
+            # A statement the database rejects must not discard every session's writes:
+            # commit them one by one and drop only the failing ones
+            for position, statement in enumerate(pending):
+                try:
+                    self._commit([statement])
+                except sqlite3.OperationalError:
+                    with self._pending_changed:
+                        self._pending[:0] = pending[position:]
+                    raise
+                except sqlite3.DatabaseError as e:
+                    record_error("storage.write", e)
+        with self._cache_lock:
+            self._cache.clear()
+            self._generation += 1
+
+    def _commit(self, pending):
+        """Run (sql, params) statements in a single transaction."""
+        with self._db_lock:
+            self._db.execute("BEGIN")
+            try:
+                # Consecutive identical statements go through one executemany
+                start = 0
+                while start < len(pending):
+                    end = start
+                    while end < len(pending) and pending[end][0] == pending[start][0]:
+                        end += 1
+                    self._db.executemany(pending[start][0], [params for _, params in pending[start:end]])
+                    start = end
+                self._db.execute("COMMIT")
+            except Exception:
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                raise
+
+    def add_announcement(self, title, description, image_path, date="Ajoutée aujourd'hui"):
+        self._enqueue(
+            "INSERT INTO announcements (title, date, description, image, created_at) VALUES (?, ?, ?, ?, ?)",
+            (title, date, description, image_path, time.time()),
+        )
+
+    def add_comment(self, announcement_id, body):
+        self._enqueue(
+            "INSERT INTO comments (announcement_id, body, created_at) VALUES (?, ?, ?)",
+            (announcement_id, body, time.time()),
+        )
+
+    def add_comment_scores(self, scores):
+        """Store (comment id, announcement id, sentiment, toxicity) rows; None marks an unscorable comment."""
+        now = time.time()
+        for comment_id, announcement_id, sentiment, toxicity in scores:
+            self._enqueue(
+                "INSERT OR REPLACE INTO comment_scores (comment_id, announcement_id, sentiment, toxicity, scored_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (comment_id, announcement_id, sentiment, toxicity, now),
+            )
+
+    def add_to_proposals(self, announcement_id):
+        """Propose an announcement with the comments it has right now (no copy is made)."""
+        self._enqueue(
+            "INSERT INTO proposals (announcement_id, last_comment_id, created_at) "
+            "SELECT ?, COALESCE(MAX(id), 0), ? FROM comments WHERE announcement_id = ?",
+            (announcement_id, time.time(), announcement_id),
+        )
+
+    def add_chat_message(self, conversation_id, seq, role, content):
+        """Archive a chat message, so the page only has to keep the latest ones."""
+        self._enqueue(
+            "INSERT OR REPLACE INTO chat_messages (conversation_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+            (conversation_id, seq, role, content, time.time()),
+        )
+
+    # Reads
+
+    def _query(self, sql, params=()):
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _cached(self, key, loader):
+        """Read-through cache shared by all sessions; cleared on every flush."""
+        if self._pending:
+            self.flush()  # read your own writes
+        with self._cache_lock:
+            if key in self._cache:
+                return self._cache[key]
+            generation = self._generation
+        value = loader()
+        with self._cache_lock:
+            # Don't cache a value read before a concurrent flush
+            if generation == self._generation:
+                self._cache[key] = value
+        return value
+
+    def list_announcements(self):
+        return self._cached("announcements", lambda: [
+            {"id": row["id"], "title": row["title"], "date": row["date"], "desc": row["description"], "image": row["image"]}
+            for row in self._query("SELECT * FROM announcements ORDER BY id")
+        ])
+
+    def list_announcements_page(self, after_id=0, limit=10):
+        """One feed page (keyset pagination on id) and the cursor of the next page, or None."""
+        def load():
+            rows = self._query(
+                "SELECT * FROM announcements WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit + 1)
+            )
+            page = [
+                {"id": row["id"], "title": row["title"], "date": row["date"], "desc": row["description"], "image": row["image"]}
+                for row in rows[:limit]
+            ]
+            next_cursor = page[-1]["id"] if len(rows) > limit else None
+            return page, next_cursor
+        return self._cached(("announcements_page", after_id, limit), load)
+
+    def comment_counts(self, announcement_ids):
+        """Number of comments of each announcement, in one grouped query."""
+        ids = tuple(announcement_ids)
+        def load():
+            counts = dict.fromkeys(ids, 0)
+            if ids:
+                rows = self._query(
+                    f"SELECT announcement_id, COUNT(*) AS n FROM comments WHERE announcement_id IN "
+                    f"({', '.join('?' * len(ids))}) GROUP BY announcement_id",
+                    ids,
+                )
+                counts.update((row["announcement_id"], row["n"]) for row in rows)
+            return counts
+        return self._cached(("comment_counts", ids), load)
+
+    def list_comments(self, announcement_id, max_toxicity=None):
+        """Comment bodies, oldest first; with max_toxicity, comments scored at or above it are left out."""
+        if max_toxicity is None:
+            return self._cached(("comments", announcement_id), lambda: [
+                row["body"] for row in self._query(
+                    "SELECT body FROM comments WHERE announcement_id = ? ORDER BY id", (announcement_id,)
+                )
+            ])
+        # Comments not scored yet are shown; the moderation worker catches up within seconds
+        return self._cached(("comments", announcement_id, max_toxicity), lambda: [
+            row["body"] for row in self._query(
+                "SELECT c.body FROM comments c LEFT JOIN comment_scores s ON s.comment_id = c.id "
+                "WHERE c.announcement_id = ? AND (s.toxicity IS NULL OR s.toxicity < ?) ORDER BY c.id",
+                (announcement_id, max_toxicity),
+            )
+        ])
+
+    def unscored_comments(self, limit):
+        """Oldest comments without a moderation score, as (id, announcement id, body) rows."""
+        return [
+            (row["id"], row["announcement_id"], row["body"]) for row in self._query(
+                "SELECT c.id, c.announcement_id, c.body FROM comments c "
+                "LEFT JOIN comment_scores s ON s.comment_id = c.id "
+                "WHERE s.comment_id IS NULL ORDER BY c.id LIMIT ?",
+                (limit,),
+            )
+        ]
+
+    def comment_score_aggregates(self, toxicity_threshold):
+        """Per announcement: scored comments, mean sentiment and comments at or above the toxicity threshold."""
+        return self._cached(("comment_score_aggregates", toxicity_threshold), lambda: {
+            row["announcement_id"]: {"scored": row["scored"], "sentiment": row["sentiment"], "toxic": row["toxic"]}
+            for row in self._query(
+                "SELECT announcement_id, COUNT(*) AS scored, AVG(sentiment) AS sentiment, "
+                "SUM(toxicity >= ?) AS toxic FROM comment_scores GROUP BY announcement_id",
+                (toxicity_threshold,),
+            )
+        })
+
+    def list_chat_messages(self, conversation_id, before_seq, limit):
+        """Up to `limit` archived messages of a conversation preceding `before_seq`, oldest first."""
+        return self._cached(("chat_messages", conversation_id, before_seq, limit), lambda: [
+            {"role": row["role"], "content": row["content"], "seq": row["seq"]}
+            for row in reversed(self._query(
+                "SELECT seq, role, content FROM chat_messages WHERE conversation_id = ? AND seq < ? "
+                "ORDER BY seq DESC LIMIT ?",
+                (conversation_id, before_seq, limit),
+            ))
+        ])
+
+    def list_proposals(self, max_toxicity=None):
+        """Proposed announcements, oldest first, each with the comments it had when proposed
+        (filtered by max_toxicity as in list_comments)."""
+        def load():
+            announcements = {a["id"]: a for a in self.list_announcements()}
+            query = "SELECT c.body FROM comments c WHERE c.announcement_id = ? AND c.id <= ? ORDER BY c.id"
+            if max_toxicity is not None:
+                query = ("SELECT c.body FROM comments c LEFT JOIN comment_scores s ON s.comment_id = c.id "
+                         "WHERE c.announcement_id = ? AND c.id <= ? AND (s.toxicity IS NULL OR s.toxicity < ?) ORDER BY c.id")
+            return [
+                {
+                    "announcement": announcements[row["announcement_id"]],
+                    "comments": [
+                        comment["body"] for comment in self._query(
+                            query, (row["announcement_id"], row["last_comment_id"]) + ((max_toxicity,) if max_toxicity is not None else ()),
+                        )
+                    ],
+                }
+                for row in self._query("SELECT announcement_id, last_comment_id FROM proposals ORDER BY id")
+                if row["announcement_id"] in announcements
+            ]
+        return self._cached(("proposals", max_toxicity), load)
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Return the process-wide storage."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = Storage()
+        return _storage
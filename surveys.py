@@ -0,0 +1,147 @@
+import os
+import time
+import threading
+from datetime import datetime, timezone
+
+from lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+
+SURVEY_FOLDER = os.getenv("SURVEY_FOLDER", "data/surveys")
+SURVEY_BATCH_SIZE = 256  # responses that trigger an immediate flush
+SURVEY_FLUSH_INTERVAL = 2.0  # seconds a response may wait to be batched with others
+COMPACT_AFTER_PARTS = 32  # part files merged into one once there are this many
+
+SATISFACTION_LEVELS = ["Très satisfait", "Satisfait", "Neutre", "Insatisfait", "Très insatisfait"]
+
+
+def _schema():
+    return pa.schema([
+        ("theme", pa.string()),
+        ("sub_themes", pa.list_(pa.string())),
+        ("satisfaction", pa.string()),
+        ("comment", pa.string()),
+        ("submitted_at", pa.timestamp("s", tz="UTC")),
+    ])
+
+
+class SurveyStore:
+    """Append-only survey responses in Parquet part files, written in micro-batches."""
+
+    def __init__(self, folder=SURVEY_FOLDER):
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.version = 0
+        self._buffer = []
+        self._buffer_changed = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+        threading.Thread(target=self._writer, name="survey-writer", daemon=True).start()
+
+    def submit(self, theme, sub_themes, satisfaction, comment=""):
+        """Queue one response; it is written with the next batch."""
+        with self._buffer_changed:
+            self._buffer.append({
+                "theme": theme,
+                "sub_themes": list(sub_themes),
+                "satisfaction": satisfaction,
+                "comment": comment,
+                "submitted_at": datetime.now(timezone.utc),
+            })
+            self._buffer_changed.notify()
+
+    def _writer(self):
+        while True:
+            with self._buffer_changed:
+                while not self._buffer:
+                    self._buffer_changed.wait()
+                deadline = time.monotonic() + SURVEY_FLUSH_INTERVAL
+                while len(self._buffer) < SURVEY_BATCH_SIZE and time.monotonic() < deadline:
+                    self._buffer_changed.wait(deadline - time.monotonic())
+            self.flush()
+
+    def _parts(self):
+        return sorted(name for name in os.listdir(self.folder) if name.endswith(".parquet"))
+
+    def flush(self):
+        """Write buffered responses as one new part file."""
+        with self._flush_lock:
+            with self._buffer_changed:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return
+            table = pa.Table.from_pylist(rows, schema=_schema())
+            name = f"part-{time.time_ns()}.parquet"
+            pq.write_table(table, os.path.join(self.folder, name + ".tmp"))
+            os.replace(os.path.join(self.folder, name + ".tmp"), os.path.join(self.folder, name))
+            if len(self._parts()) >= COMPACT_AFTER_PARTS:
+                self._compact()
+            self.version += 1
+
+    def _compact(self):
+        """Merge every part file into one so reads stay a single scan."""
+        parts = self._parts()
+        table = pa.concat_tables([pq.read_table(os.path.join(self.folder, part)) for part in parts])
+        name = f"part-{time.time_ns()}.parquet"
+        pq.write_table(table, os.path.join(self.folder, name + ".tmp"))
+        os.replace(os.path.join(self.folder, name + ".tmp"), os.path.join(self.folder, name))
+        for part in parts:
+            os.remove(os.path.join(self.folder, part))
+
+    def load(self, columns=None):
+        """Every response as a DataFrame (optionally only some columns)."""
+        self.flush()
+        # Under the flush lock: a compaction must not delete the parts being read, nor
+        # show its merged part next to the parts it replaces
+        with self._flush_lock:
+            parts = self._parts()
+            tables = [pq.read_table(os.path.join(self.folder, part), columns=columns) for part in parts]
+        if not tables:
+            table = _schema().empty_table()
+            return (table.select(columns) if columns else table).to_pandas()
+        return pa.concat_tables(tables).to_pandas()
+
+    def aggregates(self, theme=None):
+        """Dashboard figures for one theme (or all), memoized until new responses are written."""
+        self.flush()
+        key = (self.version, theme)
+        with self._memo_lock:
+            if key in self._memo:
+                return self._memo[key]
+
+        df = self.load(columns=["theme", "sub_themes", "satisfaction", "submitted_at"])
+        if theme is not None:
+            df = df[df["theme"] == theme]
+
+        satisfaction = pd.Categorical(df["satisfaction"], categories=SATISFACTION_LEVELS)
+        monthly = df.groupby(df["submitted_at"].dt.tz_convert(None).dt.to_period("M")).size()
+        monthly.index = monthly.index.astype(str)
+        result = {
+            "responses": len(df),
+            "by_theme": df.groupby("theme").size().sort_values(ascending=False),
+            "by_sub_theme": df["sub_themes"].explode().dropna().value_counts(),
+            "satisfaction": pd.Series(satisfaction).value_counts(sort=False),
+            "monthly": monthly.sort_index(),
+        }
+        with self._memo_lock:
+            # Older versions can't be asked for again
+            self._memo = {k: v for k, v in self._memo.items() if k[0] == self.version}
+            self._memo[key] = result
+        return result
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_survey_store():
+    """Return the process-wide survey store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SurveyStore()
+        return _store
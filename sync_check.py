@@ -0,0 +1,254 @@
+"""Offline check of the GitHub document sync against a local stand-in for the GitHub API.
+
+A fake GitHub server serves a repository whose branch is edited between runs, and
+sync_github_documents then sync_and_ingest go through the add, change and remove paths:
+what is downloaded, what is deleted, and what ends up in the vector and keyword indexes.
+OpenAI is the benchmark's fake server and the vector index a local one, so no token or
+API key is needed. The stand-in's PDFs hold plain text, read in place of the OCR step::
+
+    python sync_check.py
+"""
+import os
+import sys
+import json
+import base64
+import hashlib
+import tempfile
+import threading
+from urllib.parse import urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from benchmark import Faults, make_openai_server
+
+REPO_NAME = "voxpopuli/documents"
+BRANCH = "documents"
+
+
+def blob_sha(content):
+    """Git's blob id of some content."""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def make_github_server(files):
+    """Fake GitHub API serving one repository whose branch holds ``files`` ({path: bytes}),
+    read at each request so the caller can edit it between syncs.
+
+    Returns the server, its base URL and its state: the blob SHAs downloaded, and whether
+    recursive tree listings come back truncated, as GitHub does for large trees.
+    """
+    state = {"downloads": [], "truncated": False}
+
+    def trees():
+        """{tree SHA: [(name, type, SHA)]} of the branch, and its root tree SHA."""
+        folders = {}
+        for file_path, content in files.items():
+            parts = file_path.split("/")
+            for depth in range(len(parts)):
+                folders.setdefault("/".join(parts[:depth]), set())
+            folders["/".join(parts[:-1])].add((parts[-1], "blob", blob_sha(content)))
+        shas, listing = {}, {}
+        # Deepest folders first, so a folder's SHA is known before its parent lists it
+        for folder in sorted(folders, key=lambda name: -name.count("/") if name else 1):
+            entries = sorted(folders[folder])
+            sha = hashlib.sha1(json.dumps(entries).encode("utf-8")).hexdigest()
+            shas[folder], listing[sha] = sha, entries
+            if folder:
+                parent, _, name = folder.rpartition("/")
+                folders[parent].add((name, "tree", sha))
+        return listing, shas[""]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _tree(self, repo_url, listing, sha, recursive):
+            elements, pending = [], [("", sha)]
+            while pending:
+                base, tree_sha = pending.pop(0)
+                for name, kind, element_sha in listing[tree_sha]:
+                    elements.append({"path": base + name, "mode": "040000" if kind == "tree" else "100644",
+                                     "type": kind, "sha": element_sha, "url": f"{repo_url}/git/{kind}s/{element_sha}"})
+                    if recursive and kind == "tree":
+                        pending.append((base + name + "/", element_sha))
+            truncated = recursive and state["truncated"]
+            self._json(200, {"sha": sha, "url": f"{repo_url}/git/trees/{sha}", "truncated": truncated,
+                             "tree": elements[:1] if truncated else elements})
+
+        def do_GET(self):
+            repo_url = f"http://{self.headers['Host']}/api/v3/repos/{REPO_NAME}"
+            url = urlparse(self.path)
+            path = url.path[len(f"/api/v3/repos/{REPO_NAME}"):] if url.path.startswith(f"/api/v3/repos/{REPO_NAME}") else None
+            listing, root_sha = trees()
+            blobs = {blob_sha(content): content for content in files.values()}
+            # The commit is named after its root tree: one SHA to list, as a commit or as a tree
+            commit_sha = root_sha
+
+            if path == "":
+                self._json(200, {"id": 1, "name": REPO_NAME.split("/")[1], "full_name": REPO_NAME,
+                                 "url": repo_url, "default_branch": "main"})
+            elif path == f"/branches/{BRANCH}":
+                self._json(200, {"name": BRANCH, "commit": {"sha": commit_sha, "url": f"{repo_url}/commits/{commit_sha}"}})
+            elif path is not None and path.startswith("/git/trees/") and path.rsplit("/", 1)[1] in listing:
+                self._tree(repo_url, listing, path.rsplit("/", 1)[1], "recursive=1" in url.query)
+            elif path is not None and path.startswith("/git/blobs/") and path.rsplit("/", 1)[1] in blobs:
+                sha = path.rsplit("/", 1)[1]
+                state["downloads"].append(sha)
+                self._json(200, {"sha": sha, "size": len(blobs[sha]), "url": f"{repo_url}/git/blobs/{sha}",
+                                 "encoding": "base64", "content": base64.b64encode(blobs[sha]).decode("ascii")})
+            else:
+                self._json(404, {"message": "Not Found"})
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-github", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/v3", state
+
+
+class Checker:
+    """Collects failed expectations instead of stopping at the first one."""
+
+    def __init__(self):
+        self.failures = []
+
+    def equal(self, label, actual, expected):
+        if actual != expected:
+            self.failures.append(f"{label}: expected {expected!r}, got {actual!r}")
+
+
+def check_sync(repo, files, state, workdir, checker):
+    """sync_github_documents alone: only added or changed PDFs are downloaded, removed ones
+    deleted, and a truncated tree listing is completed rather than taken for removals."""
+    from github_sync import list_remote_pdfs, load_manifest, sync_github_documents
+
+    downloads = state["downloads"]
+    dest_dir, manifest_path = os.path.join(workdir, "sync"), os.path.join(workdir, "sync_manifest.json")
+    sync = lambda: sync_github_documents(repo, BRANCH, dest_dir=dest_dir, manifest_path=manifest_path)
+
+    changes = sync()
+    checker.equal("sync: first run", changes, {"added": ["a.pdf", "b.pdf", "sub/c.pdf"], "changed": [], "removed": []})
+    checker.equal("sync: downloads of the first run", len(downloads), 3)
+    checker.equal("sync: downloaded content", open(os.path.join(dest_dir, "sub", "c.pdf"), "rb").read(), files["sub/c.pdf"])
+
+    del downloads[:]
+    files["b.pdf"] = "Nouvelle version : le budget du parc passe au vote des habitants.".encode("utf-8")
+    del files["sub/c.pdf"]
+    changes = sync()
+    checker.equal("sync: second run", changes, {"added": [], "changed": ["b.pdf"], "removed": ["sub/c.pdf"]})
+    checker.equal("sync: downloads of the second run", downloads, [blob_sha(files["b.pdf"])])
+    checker.equal("sync: removed file", os.path.exists(os.path.join(dest_dir, "sub", "c.pdf")), False)
+    checker.equal("sync: manifest", load_manifest(manifest_path), {path: blob_sha(files[path]) for path in ("a.pdf", "b.pdf")})
+
+    del downloads[:]
+    checker.equal("sync: unchanged branch", sync(), {"added": [], "changed": [], "removed": []})
+    checker.equal("sync: downloads of an unchanged branch", downloads, [])
+
+    state["truncated"] = True
+    checker.equal("sync: truncated listing of an unchanged branch", sync(), {"added": [], "changed": [], "removed": []})
+    files["sub/deep/d.pdf"] = "Le marché du samedi change de place.".encode("utf-8")
+    checker.equal("sync: truncated listing with a new file", sync(), {"added": ["sub/deep/d.pdf"], "changed": [], "removed": []})
+    checker.equal("sync: truncated listing of a folder", list_remote_pdfs(repo, BRANCH, "sub"),
+                  {"sub/deep/d.pdf": blob_sha(files["sub/deep/d.pdf"])})
+    state["truncated"] = False
+
+
+def check_sync_and_ingest(repo, files, index, checker):
+    """sync_and_ingest: changed documents are re-indexed and removed ones leave both indexes."""
+    import ingest
+    from bm25 import get_bm25_index
+    from namespaces import SHARED_NAMESPACE
+
+    ingest.extract_text_from_pdf = lambda content: content.decode("utf-8")
+
+    def indexed():
+        """Checkpointed documents, and the ids in the vector and keyword indexes."""
+        checkpoint = ingest.load_checkpoint()
+        vector_ids = set(index.namespaces[SHARED_NAMESPACE].ids) if SHARED_NAMESPACE in index.namespaces else set()
+        keyword_index = get_bm25_index()
+        return checkpoint["documents"], vector_ids, set(keyword_index.ids if keyword_index else [])
+
+    def keyword_hits(word):
+        return sorted({match.metadata["file_path"] for match in get_bm25_index().search(word, top_k=10)})
+
+    changes = ingest.sync_and_ingest(repo, index, BRANCH, progress=None)
+    documents, vector_ids, keyword_ids = indexed()
+    checker.equal("ingest: first run", changes, {"added": ["a.pdf", "b.pdf", "sub/c.pdf"], "changed": [], "removed": []})
+    checker.equal("ingest: checkpointed documents", sorted(documents), ["a.pdf", "b.pdf", "sub/c.pdf"])
+    expected_ids = {vector_id for entry in documents.values() for vector_id in entry["ids"]}
+    checker.equal("ingest: vector ids", vector_ids, expected_ids)
+    checker.equal("ingest: keyword ids", keyword_ids, expected_ids)
+    checker.equal("ingest: keyword search", keyword_hits("bibliothèque"), ["sub/c.pdf"])
+
+    kept_ids = documents["a.pdf"]["ids"]
+    files["b.pdf"] = "Nouvelle version : le budget du parc passe au vote des habitants.".encode("utf-8")
+    del files["sub/c.pdf"]
+    changes = ingest.sync_and_ingest(repo, index, BRANCH, progress=None)
+    documents, vector_ids, keyword_ids = indexed()
+    checker.equal("ingest: second run", changes, {"added": [], "changed": ["b.pdf"], "removed": ["sub/c.pdf"]})
+    checker.equal("ingest: checkpointed documents after the change", sorted(documents), ["a.pdf", "b.pdf"])
+    checker.equal("ingest: sha of the changed document", documents["b.pdf"]["sha"], blob_sha(files["b.pdf"]))
+    checker.equal("ingest: unchanged document", documents["a.pdf"]["ids"], kept_ids)
+    expected_ids = {vector_id for entry in documents.values() for vector_id in entry["ids"]}
+    checker.equal("ingest: vector ids after the change", vector_ids, expected_ids)
+    checker.equal("ingest: keyword ids after the change", keyword_ids, expected_ids)
+    checker.equal("ingest: removed document", keyword_hits("bibliothèque"), [])
+    checker.equal("ingest: changed document", keyword_hits("nouvelle"), ["b.pdf"])
+
+
+def initial_files():
+    return {
+        "a.pdf": "Le conseil de quartier propose une piste cyclable rue de la Paix.".encode("utf-8"),
+        "b.pdf": "Le budget participatif finance la rénovation du parc municipal.".encode("utf-8"),
+        "sub/c.pdf": "La bibliothèque ouvrira le dimanche après la consultation.".encode("utf-8"),
+        "README.md": b"Not a PDF: never synced.",
+    }
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="voxpopuli-sync-")
+    files = initial_files()
+    github_server, github_url, state = make_github_server(files)
+    openai_server, openai_url = make_openai_server(Faults(), dimension=64)
+    # Point every pipeline module at the stand-ins before they are imported
+    os.environ.update({
+        "GITHUB_API_URL": github_url,
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": "sync-check",
+        "GITHUB_MANIFEST_PATH": os.path.join(workdir, "manifest.json"),
+        "DOCUMENTS_DIR": os.path.join(workdir, "documents"),
+        "INGEST_CHECKPOINT_PATH": os.path.join(workdir, "checkpoint.json"),
+        "BM25_DIR": os.path.join(workdir, "bm25"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embeddings.sqlite3"),
+        "METRICS_PATH": os.path.join(workdir, "metrics.prom"),
+        "INDEX_VERSION_PATH": os.path.join(workdir, "index_version"),
+    })
+    from github_sync import open_github_repo
+    from local_index import LocalIndex
+
+    checker = Checker()
+    repo = open_github_repo("sync-check", REPO_NAME)
+    check_sync(repo, files, state, workdir, checker)
+    # Same starting branch for the ingestion, which syncs into its own folder
+    files.clear()
+    files.update(initial_files())
+    check_sync_and_ingest(repo, files, LocalIndex(os.path.join(workdir, "index")), checker)
+    github_server.shutdown()
+    openai_server.shutdown()
+
+    for failure in checker.failures:
+        print(failure, file=sys.stderr)
+    print(f"{len(checker.failures)} failed expectations" if checker.failures else "GitHub sync checks passed", file=sys.stderr)
+    sys.exit(1 if checker.failures else 0)
+
+
+if __name__ == "__main__":
+    main()